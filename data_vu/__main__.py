@@ -0,0 +1,3 @@
+from data_vu.cli import main
+
+main()
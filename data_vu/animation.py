@@ -0,0 +1,294 @@
+"""Animations of one panel (x v y, one z-slice) through a run's generations.
+
+The figure, axes and artists are built once; each frame only swaps in the
+new generation's data (scatter offsets, bin-mesh colours, highlight
+outlines) and is streamed to the movie writer, so frames aren't held in
+memory (except by the Pillow writer, which is used only without ffmpeg or
+ImageMagick) and the work per frame follows what changed between
+generations, not the size of the run.
+
+"""
+import os
+
+import numpy as np
+
+from data_vu.utilities import *
+from data_vu.queries import *
+from data_vu.files import load_config_file
+from data_vu.plotting import bin_grid, bin_outline_vertices, plot_bin_outlines
+from data_vu.run_data import RunData
+from data_vu.context import RunContext
+
+def get_writer(file_name, fps=2, writer=None):
+    """Picks a `matplotlib.animation` writer for `file_name`.
+
+    Args:
+        file_name (str): `.mp4`, `.gif`, `.png`/`.apng` (animated PNG, Pillow
+            only).
+        fps (float): frames per second.
+        writer (str): `ffmpeg`, `imagemagick`, `pillow`; by default ffmpeg if
+            it's installed, then ImageMagick for GIFs, then Pillow.
+
+    Returns:
+        writer (matplotlib.animation.MovieWriter)
+
+    """
+    from matplotlib import animation
+
+    extension = os.path.splitext(file_name)[1].lower()
+    if writer == None:
+        if animation.writers.is_available('ffmpeg') and extension in ['.mp4', '.gif']:
+            writer = 'ffmpeg'
+        elif animation.writers.is_available('imagemagick') and extension == '.gif':
+            writer = 'imagemagick'
+        else:
+            writer = 'pillow'
+    if writer == 'pillow' and extension not in ['.gif', '.png', '.apng']:
+        raise ValueError('%s needs ffmpeg; save as .gif instead' % file_name)
+    return animation.writers[writer](fps=fps)
+
+def get_animation_file_name(run_id, data_type, x, y, generations, z_bin, output_dir=None):
+    """Returns the default path of an animation: `.mp4` if ffmpeg is
+    installed, `.gif` otherwise.
+    """
+    from matplotlib import animation
+
+    extension = 'mp4' if animation.writers.is_available('ffmpeg') else 'gif'
+    file_name = '%s_%s_%s_%s_' % (run_id, x, y, data_type) + \
+        'bin%s_' % z_bin + \
+        'gens%sto%s.%s' % (generations[0], generations[-1], extension)
+    if output_dir != None:
+        file_name = os.path.join(output_dir, file_name)
+    return file_name
+
+class PointFrames(object):
+    """DataPoints frames. Earlier generations are accumulated into one image
+    at the saved frame's resolution, one pixel per cell, each drawn as the
+    stacked alpha-0.2 black points it replaces; only a new generation's
+    points are added to it. The current generation and its parents are
+    updated in place.
+    """
+
+    def __init__(self, context, ax, x, y, z_bin, highlight_parents='on', highlight_children='on',
+                 dpi=96):
+        self.context = context
+        self.ax = ax
+        self.x = x
+        self.y = y
+        self.z_bin = z_bin
+        self.highlight_parents = highlight_parents
+        self.history_end = None
+
+        width, height = ax.get_position().size * ax.figure.get_size_inches() * dpi
+        self.extent = list(context.get_limits(x)) + list(context.get_limits(y))
+        self.history_counts = np.zeros((max(int(height), 1), max(int(width), 1)))
+        self.history_image = np.zeros(self.history_counts.shape + (4,))
+        self.history = ax.imshow(
+            self.history_image,
+            extent=self.extent,
+            origin='lower',
+            aspect='auto',
+            interpolation='nearest',
+            zorder=1
+        )
+        child_colour = 'r' if highlight_children == 'on' else 'k'
+        self.children = ax.scatter(
+            [], [],
+            marker='o',
+            facecolors=child_colour,
+            edgecolors='none',
+            alpha=0.6, s=2,
+            zorder=2
+        )
+        self.parents = ax.scatter(
+            [], [],
+            marker='o',
+            facecolors='none',
+            edgecolors='y',
+            linewidth=0.2,
+            alpha=0.6, s=4,
+            zorder=3
+        )
+
+    def add_history(self, values):
+        values = np.asarray(values, dtype=float).reshape(-1, 2)
+        if len(values) > 0:
+            rows, columns = self.history_counts.shape
+            counts, _, _ = np.histogram2d(
+                values[:, 1], values[:, 0],
+                bins=(rows, columns),
+                range=(self.extent[2:], self.extent[:2])
+            )
+            self.history_counts += counts
+            self.history_image[..., 3] = 1 - 0.8 ** self.history_counts
+            self.history.set_data(self.history_image)
+
+    def update(self, gen):
+        args = (self.x, self.y, self.z_bin, self.context.run_id)
+        run_data = self.context.run_data
+        if self.history_end == None:
+            self.add_history(query_previous_points(*args, gen, run_data))
+        else:
+            for previous_gen in range(self.history_end, gen):
+                self.add_history(query_points(*args, previous_gen, run_data))
+        self.history_end = gen
+
+        values = np.asarray(query_points(*args, gen, run_data), dtype=float).reshape(-1, 2)
+        self.children.set_offsets(values)
+        if self.highlight_parents == 'on' and gen != 0:
+            values = np.asarray(query_parents(*args, gen, run_data), dtype=float).reshape(-1, 2)
+            self.parents.set_offsets(values)
+        else:
+            self.parents.set_offsets(np.empty((0, 2)))
+
+class BinFrames(object):
+    """BinCounts and MutationStrengths frames: one bin mesh whose colours,
+    and two outline collections whose squares, are replaced per generation.
+    BinCounts colours are scaled by the run's max bin-count throughout.
+    """
+
+    def __init__(self, context, ax, data_type, x, y, z_bin,
+                 highlight_parents='on', highlight_children='on'):
+        import matplotlib.cm as cm
+
+        self.context = context
+        self.data_type = data_type
+        if data_type == 'BinCounts':
+            x, y = x + '_bin', y + '_bin'
+            self.scale = float(get_max_count(context.run_id, context.run_data, context.summary))
+        else:
+            x, y = x + '_mutation_strength', y + '_mutation_strength'
+            self.scale = 1.
+        self.x = x
+        self.y = y
+        self.z_bin = z_bin
+        self.highlight_parents = highlight_parents
+        self.highlight_children = highlight_children
+        number_of_bins = context.number_of_bins
+        self.mesh = ax.pcolormesh(
+            np.arange(number_of_bins + 1) * context.get_width(x),
+            np.arange(number_of_bins + 1) * context.get_width(y),
+            np.ma.masked_all((number_of_bins, number_of_bins)),
+            cmap = cm.Reds,
+            vmin = 0,
+            vmax = 1,
+            shading = 'flat'
+        )
+        self.parents = plot_bin_outlines([], x, y, ax, context.config, 'y', 2)
+        self.children = plot_bin_outlines([], x, y, ax, context.config, 'r', 1, ':')
+
+    def update(self, gen):
+        context = self.context
+        args = (self.x, self.y, self.z_bin, context.run_id, gen)
+        if self.data_type == 'BinCounts':
+            values = query_bin_counts(*args, context.run_data, context.summary)
+        else:
+            values = query_mutation_strength(*args, context.run_data, context)
+        number_of_bins = context.number_of_bins
+        grid = bin_grid(values, (0, 0), (number_of_bins, number_of_bins), self.scale)
+        self.mesh.set_array(np.ma.masked_invalid(grid.T))
+
+        parents = []
+        if self.highlight_parents == 'on' and gen != 0:
+            parents = query_parents(*args, context.run_data)
+        self.parents.set_verts(bin_outline_vertices(parents, self.x, self.y, context.config))
+        children = []
+        if self.highlight_children == 'on':
+            children = query_child_bins(*args, context.run_data, context.summary)
+        self.children.set_verts(bin_outline_vertices(children, self.x, self.y, context.config))
+
+def animate_HTSOHM(
+        run_id,
+        data_type,
+        x, y,
+        z_bin = None,
+        generations = 'all',
+        file_name = None,
+        fps = 2,
+        dpi = 96,
+        highlight_parents = 'on',
+        highlight_children = 'on',
+        preload = 'on',
+        cache = 'on',
+        writer = None,
+        output_dir = None,
+        verbose = True
+    ):
+    """Saves one panel through a run's generations as an animation, one frame
+    per generation.
+
+    Args:
+        run_id (str): run identification string.
+        data_type (str): `DataPoints`, `BinCounts`, `MutationStrengths`.
+        x (str): `ml`, `sa`, `vf`.
+        y (str): `ml`, `sa`, `vf`.
+        z_bin (int): None(default, all z_bins at once), [0, number_of_bins].
+        generations (str, int, <class 'list'>): `all`(default), [0, 1, 2, ...].
+        file_name (str): `.mp4`, `.gif`, `.png`; see `get_writer`. Defaults
+            to `get_animation_file_name`.
+        fps (float): frames (generations) per second.
+        dpi (float): resolution of the frames.
+        highlight_parents (str): `on`(default), `off`.
+        highlight_children (str): `on`(default), `off`.
+        preload (str): `on`(default), `summary`, `off`; see
+            `data_vu.figures.plot_HTSOHM`.
+        cache (str): see `data_vu.run_data.RunData.load`.
+        writer (str): see `get_writer`.
+        output_dir (str): directory for the default file name.
+        verbose (bool): print progress.
+
+    Returns:
+        file_name (str): path of the saved animation.
+
+    """
+    import matplotlib.pyplot as plt
+
+    config = load_config_file(run_id)
+    run_data = None
+    if preload == 'on':
+        run_data = RunData.load(run_id, cache=cache)
+        run_data.get_bin_count_tensor(config['number_of_convergence_bins'])
+    summary = None
+    if preload == 'summary':
+        from data_vu.summary import RunSummary
+        summary = RunSummary(run_id)
+    context = RunContext(run_id, config, run_data, summary)
+    if run_data != None and data_type == 'MutationStrengths':
+        run_data.get_strength_history(context.number_of_bins, context.initial_strength)
+
+    if generations == 'all':
+        generations = [ i for i in range( count_generations(run_id, run_data) + 1 ) ]
+    generations = sorted(make_list(generations))
+    if file_name == None:
+        file_name = get_animation_file_name(
+            run_id, data_type, x, y, generations, z_bin, output_dir
+        )
+
+    fig = plt.figure(figsize = (4, 4))
+    ax = fig.add_subplot(111)
+    if data_type == 'DataPoints':
+        frames = PointFrames(
+            context, ax, x, y, z_bin,
+            highlight_parents, highlight_children, dpi
+        )
+    else:
+        frames = BinFrames(
+            context, ax, data_type, x, y, z_bin,
+            highlight_parents, highlight_children
+        )
+    ax.set_xlim(context.get_limits(x))
+    ax.set_ylim(context.get_limits(y))
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    title = ax.set_title('')
+
+    movie_writer = get_writer(file_name, fps, writer)
+    with movie_writer.saving(fig, file_name, dpi):
+        for generation in generations:
+            if verbose:
+                print('\tgeneration:\t%s' % generation)
+            frames.update(generation)
+            title.set_text('%s %s\ngen. %s, bin %s' % (run_id, data_type, generation, z_bin))
+            movie_writer.grab_frame()
+    plt.close(fig)
+    return file_name
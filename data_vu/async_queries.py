@@ -0,0 +1,260 @@
+"""asyncio versions of the panel queries in `data_vu.queries`, and a
+`Prefetcher` that runs them ahead of the panel being drawn.
+
+The queries are the same: each function here executes the statement built by
+its `data_vu.queries.*_query` counterpart, on an async connection, and
+returns what the synchronous function would (numpy arrays for points,
+rows for bin-counts). They need an async driver for the configured database:
+`asyncpg` for PostgreSQL, `aiosqlite` for SQLite.
+
+An async engine belongs to the event loop that first uses it; pass `engine`
+explicitly (see `make_async_engine`) unless everything runs in one loop.
+
+"""
+import asyncio
+import collections
+import threading
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Query
+
+from data_vu import queries
+from data_vu.context import RunContext
+from data_vu.db import POOL_DEFAULTS, get_engine
+from data_vu.db.material import Material
+from data_vu.db.mutation_strength import MutationStrength
+from data_vu.files import load_config_file
+from data_vu.utilities import orient_bins
+
+ASYNC_DRIVERS = {
+    'postgresql' : 'postgresql+asyncpg',
+    'sqlite' : 'sqlite+aiosqlite'
+}
+
+def make_async_engine(**pool_options):
+    """Creates an async engine for the database data_vu is configured to use.
+
+    Args:
+        **pool_options: override `data_vu.db.POOL_DEFAULTS`.
+
+    """
+    url = get_engine().url
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError('no async driver known for %s databases' % backend)
+    options = dict(POOL_DEFAULTS)
+    options.update(pool_options)
+    if backend == 'sqlite':
+        for key in ['pool_size', 'max_overflow', 'pool_timeout']:
+            options.pop(key)
+    return create_async_engine(url.set(drivername=ASYNC_DRIVERS[backend]), **options)
+
+_async_engine = None
+
+def get_async_engine():
+    """Returns a shared async engine, creating it on first call."""
+    global _async_engine
+    if _async_engine == None:
+        _async_engine = make_async_engine()
+    return _async_engine
+
+async def fetch_all(query, engine=None):
+    """Runs an unbound `Query` and returns its rows."""
+    if engine == None:
+        engine = get_async_engine()
+    async with AsyncSession(engine) as async_session:
+        result = await async_session.execute(query.statement)
+        return result.all()
+
+async def fetch_array(query, width, engine=None, chunk_size=10000):
+    """Streams an unbound `Query` into a float array, `chunk_size` rows per
+    round trip.
+    """
+    if engine == None:
+        engine = get_async_engine()
+    async with AsyncSession(engine) as async_session:
+        result = await async_session.stream(query.statement)
+        chunks = [
+            np.array(rows, dtype=float).reshape(-1, width)
+            async for rows in result.partitions(chunk_size)
+        ]
+    if len(chunks) == 0:
+        return np.empty((0, width), dtype=float)
+    return np.concatenate(chunks)
+
+async def count_generations(run_id, engine=None):
+    """See `data_vu.queries.count_generations`."""
+    query = Query([func.max(Material.generation)]) \
+        .filter(Material.run_id == run_id)
+    return (await fetch_all(query, engine))[0][0]
+
+async def query_points(x, y, z_bin, run_id, gen, engine=None, chunk_size=10000):
+    """See `data_vu.queries.query_points`."""
+    query = queries.points_query(x, y, z_bin, run_id, gen)
+    return await fetch_array(query, 2, engine, chunk_size)
+
+async def query_previous_points(x, y, z_bin, run_id, gen, engine=None, chunk_size=10000):
+    """See `data_vu.queries.query_previous_points`."""
+    query = queries.previous_points_query(x, y, z_bin, run_id, gen)
+    return await fetch_array(query, 2, engine, chunk_size)
+
+async def query_bin_counts(x, y, z_bin, run_id, gen, engine=None):
+    """See `data_vu.queries.query_bin_counts`."""
+    return await fetch_all(queries.bin_counts_query(x, y, z_bin, run_id, gen), engine)
+
+async def get_max_count(run_id, engine=None):
+    """See `data_vu.queries.get_max_count`."""
+    counts = await fetch_all(queries.max_count_query(run_id), engine)
+    return max(counts)[0]
+
+async def query_mutation_strength(x, y, z_bin, run_id, gen, context=None, engine=None):
+    """See `data_vu.queries.query_mutation_strength`; always reads the
+    database (`context` only supplies the config).
+    """
+    if engine == None:
+        engine = get_async_engine()
+    if context != None:
+        number_of_bins = context.number_of_bins
+        initial_strength = context.initial_strength
+    else:
+        config = load_config_file(run_id)
+        number_of_bins = config['number_of_convergence_bins']
+        initial_strength = config.get('initial_mutation_strength', np.nan)
+    query = MutationStrength.prior_grid_query(run_id, gen, engine.dialect.name)
+    rows = await fetch_all(query, engine)
+    strengths = MutationStrength.fill_prior_grid(rows, number_of_bins, initial_strength)
+    return queries.strength_values(orient_bins(strengths, x, y), z_bin)
+
+async def query_parents(x, y, z_bin, run_id, gen, engine=None, chunk_size=10000):
+    """See `data_vu.queries.query_parents`."""
+    query = queries.parents_query(x, y, z_bin, run_id, gen)
+    return await fetch_array(query, 2, engine, chunk_size)
+
+async def query_child_bins(x, y, z_bin, run_id, gen, engine=None):
+    """See `data_vu.queries.query_child_bins`."""
+    return await fetch_all(queries.child_bins_query(x, y, z_bin, run_id, gen), engine)
+
+# number of leading arguments that identify a call; any further argument
+# (run_data, summary) must be None for a prefetched result to stand in
+KEY_ARGUMENTS = {
+    'query_points' : 5,
+    'query_previous_points' : 5,
+    'query_bin_counts' : 5,
+    'get_max_count' : 1,
+    'query_mutation_strength' : 5,
+    'query_parents' : 5,
+    'query_child_bins' : 5
+}
+
+def get_panel_queries(data_type, x, y, z_bin, run_id, gen,
+                      highlight_parents='on', highlight_children='on'):
+    """Lists the (function name, arguments) queries `data_vu.plotting` makes
+    for one panel of `data_vu.figures.plot_figure`, in order.
+    """
+    if data_type == 'BinCounts':
+        x, y = x + '_bin', y + '_bin'
+    elif data_type == 'MutationStrengths':
+        x, y = x + '_mutation_strength', y + '_mutation_strength'
+    args = (x, y, z_bin, run_id, gen)
+
+    if data_type == 'DataPoints':
+        panel = [('query_previous_points', args), ('query_points', args)]
+    elif data_type == 'BinCounts':
+        panel = [('get_max_count', (run_id,)), ('query_bin_counts', args)]
+    elif data_type == 'MutationStrengths':
+        panel = [('query_mutation_strength', args)]
+    if highlight_parents == 'on' and gen != 0:
+        panel.append(('query_parents', args))
+    if highlight_children == 'on' and data_type != 'DataPoints':
+        panel.append(('query_child_bins', args))
+    return panel
+
+class Prefetcher(object):
+    """Queries upcoming panels on an event loop in a background thread while
+    the current panel is drawn.
+
+    Panels are queued with `add_panel`; the first `depth` + 1 are queried
+    right away, and each time a panel's results are used the next queued
+    panel is started, so `depth` panels stay in flight ahead of the one
+    being drawn. While active (`with Prefetcher(context) as prefetcher:`),
+    `data_vu.queries` functions called without run_data or summary return
+    the prefetched result for the same arguments, waiting for it if it isn't
+    in yet, and query as usual otherwise.
+
+    """
+
+    def __init__(self, context, depth=2, **pool_options):
+        self.context = context
+        self.depth = depth
+        self.engine = make_async_engine(**pool_options)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.queued = collections.deque()
+        self.futures = {}
+        self.started = 0
+        self.lock = threading.Lock()
+
+    def add_panel(self, panel_queries):
+        """Queues one panel's queries, see `get_panel_queries`."""
+        self.queued.append(panel_queries)
+        self.fill(self.depth + 1)
+
+    def fill(self, started):
+        with self.lock:
+            while self.started < started and len(self.queued) > 0:
+                index = self.started
+                for name, args in self.queued.popleft():
+                    future = asyncio.run_coroutine_threadsafe(self.run(name, args), self.loop)
+                    self.futures.setdefault((name,) + tuple(args), collections.deque()) \
+                        .append((index, future))
+                self.started += 1
+
+    async def run(self, name, args):
+        function = globals()[name]
+        if name == 'query_mutation_strength':
+            return await function(*args, context=self.context, engine=self.engine)
+        return await function(*args, engine=self.engine)
+
+    def take(self, name, args, kwargs):
+        """Returns (True, result) if `name(*args, **kwargs)` was prefetched,
+        else (False, None).
+        """
+        if name not in KEY_ARGUMENTS:
+            return False, None
+        count = KEY_ARGUMENTS[name]
+        for value in list(args[count:]) + list(kwargs.values()):
+            if isinstance(value, RunContext):
+                if value.run_data != None:
+                    return False, None
+            elif value != None:
+                return False, None
+        with self.lock:
+            futures = self.futures.get((name,) + tuple(args[:count]))
+            if not futures:
+                return False, None
+            index, future = futures.popleft()
+        self.fill(index + self.depth + 1)
+        return True, future.result()
+
+    def close(self):
+        with self.lock:
+            self.queued.clear()
+            for futures in self.futures.values():
+                for index, future in futures:
+                    future.cancel()
+            self.futures.clear()
+        asyncio.run_coroutine_threadsafe(self.engine.dispose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        queries._prefetcher = self
+        return self
+
+    def __exit__(self, *exc_info):
+        queries._prefetcher = None
+        self.close()
@@ -0,0 +1,265 @@
+"""Times `data_vu.queries` and `data_vu.plotting` against synthetic runs.
+
+    python -m data_vu benchmark -o results.json
+    python -m data_vu benchmark --compare results.json
+
+Synthetic runs are written to a scratch SQLite file (`SCRATCH_DATABASE`, or
+`--database`); the database in `settings/database.yaml` is only used when
+asked for explicitly (`--configured-database`, `database=None`), since
+generating a run deletes any earlier run with the same id.
+
+"""
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import sqlalchemy
+
+import data_vu
+from data_vu.queries import *
+from data_vu.plotting import plot_points, plot_bin_counts, plot_mutation_strengths
+from data_vu.context import RunContext
+from data_vu.files import write_config_file
+from data_vu.run_data import RunData
+from data_vu.summary import RunSummary
+from data_vu.synthetic import generate_run
+from data_vu.db import session, configure, create_tables
+
+SCALES = {
+    'small' : dict(generations=10, children_per_generation=100, number_of_bins=10),
+    'medium' : dict(generations=50, children_per_generation=500, number_of_bins=10),
+    'large' : dict(generations=100, children_per_generation=2000, number_of_bins=20)
+}
+
+SOURCES = ['database', 'run_data', 'summary']
+
+SCRATCH_DATABASE = 'sqlite:///data_vu_scratch.db'
+
+def bind_database(connection_string):
+    """Points `data_vu.db.session` at another database, creating the tables.
+
+    Use this to benchmark against a scratch (e.g. SQLite) database instead of
+    the one in `settings/database.yaml`.
+
+    """
+    engine = configure(connection_string)
+    create_tables()
+    return engine
+
+def get_query_cases(run_id, gen, material_id):
+    """Returns (name, sources, function(context)) for every query benchmarked.
+
+    `sources` are those the query function can answer from; the context's
+    run_data and summary are set (or not) to match the source being timed.
+
+    """
+    x, y = 'vf', 'sa'
+    return [
+        ('count_generations', ['database', 'run_data'],
+            lambda c: count_generations(run_id, c.run_data)),
+        ('query_points', ['database', 'run_data'],
+            lambda c: query_points(x, y, None, run_id, gen, c.run_data)),
+        ('query_previous_points', ['database', 'run_data'],
+            lambda c: query_previous_points(x, y, None, run_id, gen, c.run_data)),
+        ('query_bin_counts', SOURCES,
+            lambda c: query_bin_counts(x + '_bin', y + '_bin', None, run_id, gen,
+                                       c.run_data, c.summary)),
+        ('get_max_count', SOURCES,
+            lambda c: get_max_count(run_id, c.run_data, c.summary)),
+        ('query_mutation_strength', ['database', 'run_data'],
+            lambda c: query_mutation_strength(x + '_mutation_strength', y + '_mutation_strength',
+                                              None, run_id, gen, context=c)),
+        ('query_material', ['database', 'run_data'],
+            lambda c: query_material(x, y, material_id, c.run_data)),
+        ('query_parents', ['database', 'run_data'],
+            lambda c: query_parents(x, y, None, run_id, gen, c.run_data)),
+        ('query_child_bins', SOURCES,
+            lambda c: query_child_bins(x + '_bin', y + '_bin', None, run_id, gen,
+                                       c.run_data, c.summary)),
+        ('evaluate_convergence', SOURCES,
+            lambda c: evaluate_convergence(run_id, gen, c.run_data, c.summary)),
+        ('evaluate_convergence_curve', ['database', 'run_data'],
+            lambda c: evaluate_convergence_curve(run_id, c.run_data))
+    ]
+
+def get_plot_cases(run_id, gen, generations):
+    """Returns (name, sources, function(context, ax)) for every plot type."""
+    return [
+        ('plot_points', ['database', 'run_data'],
+            lambda c, ax: plot_points(
+                'vf', 'sa', None, run_id, gen, c.config, ax, [None], generations,
+                highlight_parents='on', context=c)),
+        ('plot_bin_counts', SOURCES,
+            lambda c, ax: plot_bin_counts(
+                'vf_bin', 'sa_bin', None, run_id, gen, c.config, ax, [None], generations,
+                highlight_children='on', highlight_parents='on', context=c)),
+        ('plot_mutation_strengths', ['database', 'run_data'],
+            lambda c, ax: plot_mutation_strengths(
+                'vf_mutation_strength', 'sa_mutation_strength', None, run_id, gen,
+                c.config, ax, [None], generations,
+                highlight_children='on', highlight_parents='on', context=c))
+    ]
+
+def time_function(function, repeat):
+    """Calls `function` `repeat` times; returns min, median and every sample
+    (seconds). Anything it prints is discarded.
+    """
+    samples = []
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            samples.append(time.perf_counter() - start)
+    return {
+        'min' : min(samples),
+        'median' : float(np.median(samples)),
+        'samples' : samples
+    }
+
+def draw_plot(case, context):
+    """Draws one panel on a new figure and renders it to memory."""
+    fig = plt.figure(figsize=(2, 2))
+    ax = plt.subplot(1, 1, 1)
+    case(context, ax)
+    fig.savefig(io.BytesIO(), format='png', dpi=96)
+    plt.close(fig)
+
+def benchmark_scale(name, parameters, repeat=3, sources=SOURCES, seed=0, verbose=True):
+    """Generates one synthetic run and times every query and plot type on it.
+
+    Returns:
+        result (dict): `parameters`, `materials` (row count), `setup` (time to
+            generate the run, load RunData and refresh the summary) and
+            `timings`, keyed `<module>.<function>[<source>]`.
+
+    """
+    run_id = 'benchmark_%s' % name
+    start = time.perf_counter()
+    config = generate_run(run_id, seed=seed, **parameters)
+    write_config_file(run_id, config)
+    setup = {'generate_run' : time.perf_counter() - start}
+
+    start = time.perf_counter()
+    run_data = RunData.load(run_id, cache='off')
+    setup['RunData.load'] = time.perf_counter() - start
+    start = time.perf_counter()
+    summary = RunSummary(run_id)
+    setup['RunSummary'] = time.perf_counter() - start
+
+    contexts = {
+        'database' : RunContext(run_id, config),
+        'run_data' : RunContext(run_id, config, run_data=run_data),
+        'summary' : RunContext(run_id, config, summary=summary)
+    }
+    gen = parameters['generations'] // 2
+    generations = [i for i in range(parameters['generations'])]
+    material_id = int(run_data.id[len(run_data.id) // 2])
+
+    timings = {}
+    cases = [('queries', case) for case in get_query_cases(run_id, gen, material_id)] + \
+        [('plotting', case) for case in get_plot_cases(run_id, gen, generations)]
+    for module, (function_name, case_sources, case) in cases:
+        for source in sources:
+            if source not in case_sources:
+                continue
+            context = contexts[source]
+            if module == 'queries':
+                function = lambda: case(context)
+            else:
+                function = lambda: draw_plot(case, context)
+            key = '%s.%s[%s]' % (module, function_name, source)
+            timings[key] = time_function(function, repeat)
+            if verbose:
+                print('%-50s%10.4fs' % (key, timings[key]['min']))
+
+    return {
+        'parameters' : parameters,
+        'materials' : len(run_data.id),
+        'setup' : setup,
+        'timings' : timings
+    }
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd = os.path.dirname(data_vu.__file__),
+            stderr = subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(scales=['small', 'medium'], repeat=3, sources=SOURCES, seed=0, output=None,
+                   database=SCRATCH_DATABASE):
+    """Benchmarks every scale and (optionally) saves the results as JSON.
+
+    Args:
+        scales (<class 'list'>): names in `SCALES`.
+        repeat (int): calls per timing; `min` is the number to compare.
+        sources (<class 'list'>): `database`, `run_data`, `summary`.
+        seed (int): random seed for `data_vu.synthetic.generate_run`.
+        output (str): optional, path of the JSON file to write.
+        database (str): connection string of the database to generate the
+            runs in, see `bind_database`; None uses the configured one.
+
+    Returns:
+        results (dict): environment details and one `benchmark_scale` result
+            per scale.
+
+    """
+    matplotlib.use('Agg')
+    if database != None:
+        bind_database(database)
+    results = {
+        'created' : datetime.datetime.now().isoformat(),
+        'commit' : get_commit(),
+        'database' : session.get_bind().dialect.name,
+        'versions' : {
+            'python' : platform.python_version(),
+            'numpy' : np.__version__,
+            'sqlalchemy' : sqlalchemy.__version__,
+            'matplotlib' : matplotlib.__version__
+        },
+        'repeat' : repeat,
+        'seed' : seed,
+        'scales' : {}
+    }
+    for name in scales:
+        print('%s: %s' % (name, SCALES[name]))
+        results['scales'][name] = benchmark_scale(name, SCALES[name], repeat, sources, seed)
+
+    if output != None:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+    return results
+
+def compare_results(baseline, results, threshold=1.1):
+    """Compares two `run_benchmarks` results, timing by timing.
+
+    Returns:
+        rows (<class 'list'>): (scale, key, baseline min, new min, ratio,
+            regressed) for every timing present in both; a timing regressed if
+            it is more than `threshold` times slower.
+
+    """
+    rows = []
+    for scale, result in results['scales'].items():
+        if scale not in baseline['scales']:
+            continue
+        old_timings = baseline['scales'][scale]['timings']
+        for key, timing in result['timings'].items():
+            if key not in old_timings:
+                continue
+            old = old_timings[key]['min']
+            new = timing['min']
+            ratio = new / old if old > 0 else float('inf')
+            rows.append((scale, key, old, new, ratio, ratio > threshold))
+    return rows
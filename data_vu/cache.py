@@ -0,0 +1,161 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from sqlalchemy import func
+
+from data_vu.db import session
+from data_vu.db.material import Material
+from data_vu.db.mutation_strength import MutationStrength
+
+def get_cache_dir(run_id=None):
+    """Returns the local cache directory, or one run's subdirectory.
+
+    The cache lives in `$DATA_VU_CACHE_DIR`, or `~/.cache/data_vu` if unset.
+
+    """
+    cache_dir = os.environ.get(
+        'DATA_VU_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'data_vu')
+    )
+    if run_id != None:
+        cache_dir = os.path.join(cache_dir, run_id)
+    return cache_dir
+
+def query_fingerprint(run_id):
+    """Queries database for a cheap summary that changes whenever rows are
+    added to a run.
+
+    Args:
+        run_id (str): run identification string.
+
+    Returns:
+        fingerprint (dict): max(id), row count and max(generation) of
+            `materials`; row count and max(generation) of `mutation_strengths`.
+
+    """
+    max_id, materials, max_generation = session \
+        .query(
+            func.max(Material.id),
+            func.count(Material.id),
+            func.max(Material.generation)
+        ) \
+        .filter(Material.run_id == run_id) \
+        .one()
+    strengths, max_strength_generation = session \
+        .query(
+            func.count(MutationStrength.generation),
+            func.max(MutationStrength.generation)
+        ) \
+        .filter(MutationStrength.run_id == run_id) \
+        .one()
+    return {
+        'max_id' : max_id,
+        'materials' : materials,
+        'max_generation' : max_generation,
+        'mutation_strengths' : strengths,
+        'max_strength_generation' : max_strength_generation
+    }
+
+def get_cache_time(run_id):
+    """Returns when a run's cache was last written (seconds since the epoch),
+    or None if it isn't cached.
+
+    """
+    fingerprint_path = os.path.join(get_cache_dir(run_id), 'fingerprint.json')
+    if not os.path.exists(fingerprint_path):
+        return None
+    return os.path.getmtime(fingerprint_path)
+
+def read_run(run_id, fingerprint=None):
+    """Reads a run's cached columns, memory-mapped.
+
+    Args:
+        run_id (str): run identification string.
+        fingerprint (dict): expected fingerprint; the cache is ignored if it
+            was written for a different one. None trusts the cache as is.
+
+    Returns:
+        arrays (dict): `materials` column-name -> array, or None on a miss.
+        strength_rows (numpy.ndarray): `mutation_strengths` rows.
+
+    """
+    run_dir = get_cache_dir(run_id)
+    fingerprint_path = os.path.join(run_dir, 'fingerprint.json')
+    if not os.path.exists(fingerprint_path):
+        return None, None
+    # a missing or unreadable file (e.g. the cache being replaced right now,
+    # see write_run) is a miss
+    try:
+        with open(fingerprint_path) as file:
+            cached = json.load(file)
+        if fingerprint != None and cached['fingerprint'] != fingerprint:
+            return None, None
+
+        arrays = {}
+        for column in cached['columns']:
+            arrays[column] = np.load(
+                os.path.join(run_dir, 'materials', column + '.npy'),
+                mmap_mode = 'r'
+            )
+        strength_rows = np.load(
+            os.path.join(run_dir, 'mutation_strengths.npy'),
+            mmap_mode = 'r'
+        )
+    except (OSError, ValueError, KeyError):
+        return None, None
+    return arrays, strength_rows
+
+def write_run(run_id, arrays, strength_rows, fingerprint):
+    """Writes a run's columns to the cache, replacing any previous copy.
+
+    Columns are written as one .npy file each, so they can be memory-mapped
+    independently. The files are written to a temporary directory first; the
+    old copy is then renamed aside and the new one renamed into place (both
+    atomic) before the old one is deleted, so readers see the old cache, the
+    new one or a miss, never a partial cache. If another writer swaps its copy
+    in first, that copy is kept.
+
+    Args:
+        run_id (str): run identification string.
+        arrays (dict): `materials` column-name -> array.
+        strength_rows (numpy.ndarray): `mutation_strengths` rows.
+        fingerprint (dict): see `query_fingerprint`.
+
+    Returns:
+        None
+
+    """
+    run_dir = get_cache_dir(run_id)
+    parent_dir = os.path.dirname(run_dir)
+    if not os.path.exists(parent_dir):
+        os.makedirs(parent_dir)
+    tmp_dir = tempfile.mkdtemp(prefix='.%s.' % run_id, dir=parent_dir)
+
+    os.makedirs(os.path.join(tmp_dir, 'materials'))
+    for column, array in arrays.items():
+        np.save(os.path.join(tmp_dir, 'materials', column + '.npy'), array)
+    np.save(os.path.join(tmp_dir, 'mutation_strengths.npy'), strength_rows)
+    with open(os.path.join(tmp_dir, 'fingerprint.json'), 'w') as file:
+        json.dump({'fingerprint' : fingerprint, 'columns' : list(arrays)}, file)
+
+    old_dir = tmp_dir + '.old'
+    try:
+        os.rename(run_dir, old_dir)
+    except FileNotFoundError:
+        old_dir = None
+    try:
+        os.rename(tmp_dir, run_dir)
+    except OSError:
+        # another writer's copy got there first
+        shutil.rmtree(tmp_dir)
+    if old_dir != None:
+        shutil.rmtree(old_dir)
+
+def clear_run(run_id):
+    """Removes a run's cached columns, if any."""
+    run_dir = get_cache_dir(run_id)
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
@@ -0,0 +1,449 @@
+"""Command-line entry point: `python -m data_vu <command> ...`."""
+import argparse
+import multiprocessing
+import os
+import time
+
+ALL_DATA_TYPES = ['DataPoints', 'BinCounts', 'MutationStrengths']
+ALL_AXES = [
+    ['vf', 'sa'],
+    ['vf', 'ml'],
+    ['sa', 'ml']
+]
+
+def parse_selection(value):
+    """Parses `all`, `none`, `3`, `0,2,4` or `0-10` (inclusive).
+
+    Returns:
+        selection (str, <class 'list'>): `all`, [None] or a list of ints.
+
+    """
+    if value == 'all':
+        return 'all'
+    if value == 'none':
+        return [None]
+    selection = []
+    for part in value.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            selection.extend(range(int(first), int(last) + 1))
+        else:
+            selection.append(int(part))
+    return selection
+
+def parse_axes(value):
+    """Parses `all` or `vf:sa,sa:ml`."""
+    if value == 'all':
+        return ALL_AXES
+    return [pair.split(':') for pair in value.split(',')]
+
+def schedule_figures(run_id, generations, z_bins, data_types, axes, output_dir, cache, force,
+                     profile=None):
+    """Loads (and caches) one run and lists the figures to render for it.
+
+    Returns:
+        tasks (<class 'list'>): (run_id, data_type, x, y, generations, z_bins,
+            output_dir, profile) for every figure that is missing or older than the
+            run's cached data.
+        skipped (<class 'list'>): file names that are already up to date.
+
+    """
+    from data_vu.cache import get_cache_time
+    from data_vu.figures import get_figure_file_name
+    from data_vu.files import load_config_file
+    from data_vu.queries import count_generations
+    from data_vu.run_data import RunData
+
+    config = load_config_file(run_id)
+    run_data = RunData.load(run_id, cache=cache)
+    cache_time = get_cache_time(run_id)
+
+    if generations == 'all':
+        generations = [ i for i in range( count_generations(run_id, run_data) ) ]
+    if z_bins == 'all':
+        z_bins = [ i for i in range( config['number_of_convergence_bins'] ) ]
+
+    tasks = []
+    skipped = []
+    for data_type in data_types:
+        for [x, y] in axes:
+            file_name = get_figure_file_name(
+                run_id, data_type, x, y, generations, z_bins, output_dir
+            )
+            up_to_date = not force and os.path.exists(file_name) and \
+                cache_time != None and os.path.getmtime(file_name) >= cache_time
+            if up_to_date:
+                skipped.append(file_name)
+            else:
+                tasks.append((run_id, data_type, x, y, generations, z_bins, output_dir, profile))
+    return tasks, skipped
+
+# the run this worker last rendered; tasks are scheduled run by run, so only
+# one run's arrays (count tensor, strength snapshots) are kept per worker
+_worker_context = None
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+def render_figure(task):
+    """Renders one scheduled figure, reading run data from the local cache.
+
+    Returns:
+        file_name (str): path of the saved figure.
+        seconds (float): wall time spent rendering.
+
+    """
+    from data_vu.context import RunContext
+    from data_vu.figures import plot_figure
+    from data_vu.run_data import RunData
+
+    global _worker_context
+    run_id, data_type, x, y, generations, z_bins, output_dir, profile = task
+    start = time.time()
+    if _worker_context == None or _worker_context.run_id != run_id:
+        _worker_context = None
+        context = RunContext(run_id)
+        context.run_data = RunData.load(run_id, cache='trust')
+        context.run_data.get_bin_count_tensor(context.number_of_bins)
+        _worker_context = context
+    context = _worker_context
+    if data_type == 'MutationStrengths':
+        context.run_data.get_strength_history(context.number_of_bins, context.initial_strength)
+
+    file_name = plot_figure(
+        context, data_type, x, y,
+        generations, z_bins,
+        verbose = False,
+        output_dir = output_dir,
+        profile = profile
+    )
+    return file_name, time.time() - start
+
+def render(args):
+    generations = parse_selection(args.generations)
+    z_bins = parse_selection(args.z_bins)
+    data_types = ALL_DATA_TYPES if args.data_types == 'all' else args.data_types.split(',')
+    axes = parse_axes(args.axes)
+    cache = 'trust' if args.trust_cache else 'on'
+    if args.output_dir != None and not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    tasks = []
+    for run_id in args.run_ids:
+        run_tasks, skipped = schedule_figures(
+            run_id, generations, z_bins, data_types, axes,
+            args.output_dir, cache, args.force,
+            profile = True if args.profile else None
+        )
+        for file_name in skipped:
+            print('up to date\t%s' % file_name)
+        tasks.extend(run_tasks)
+    print('%s figure(s) to render with %s worker(s)' % (len(tasks), args.workers))
+
+    start = time.time()
+    if args.workers > 1:
+        from data_vu.db import session
+        session.remove()
+        pool = multiprocessing.Pool(args.workers, initializer=_init_worker)
+        try:
+            for file_name, seconds in pool.imap_unordered(render_figure, tasks):
+                print('%8.1fs\t%s' % (seconds, file_name))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker()
+        for task in tasks:
+            file_name, seconds = render_figure(task)
+            print('%8.1fs\t%s' % (seconds, file_name))
+    print('rendered %s figure(s) in %.1fs' % (len(tasks), time.time() - start))
+
+def watch(args):
+    from data_vu.figures import watch_HTSOHM
+
+    data_types = ALL_DATA_TYPES if args.data_types == 'all' else args.data_types.split(',')
+    if args.output_dir != None and not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    _init_worker()
+    watch_HTSOHM(
+        args.run_id,
+        parse_selection(args.z_bins),
+        data_types,
+        parse_axes(args.axes),
+        interval = args.interval,
+        output_dir = args.output_dir
+    )
+
+def animate(args):
+    from data_vu.animation import animate_HTSOHM
+
+    if args.output_dir != None and not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    z_bin = None if args.z_bin == 'none' else int(args.z_bin)
+    _init_worker()
+    for data_type in ALL_DATA_TYPES if args.data_types == 'all' else args.data_types.split(','):
+        for x, y in parse_axes(args.axes):
+            start = time.time()
+            file_name = animate_HTSOHM(
+                args.run_id, data_type, x, y,
+                z_bin = z_bin,
+                generations = parse_selection(args.generations),
+                fps = args.fps,
+                dpi = args.dpi,
+                writer = args.writer,
+                output_dir = args.output_dir,
+                verbose = False
+            )
+            print('%8.1fs\t%s' % (time.time() - start, file_name))
+
+def indexes(args):
+    from data_vu.db import engine
+    from data_vu.db.indexes import find_missing_indexes, create_indexes
+
+    missing = find_missing_indexes(engine)
+    if len(missing) == 0:
+        print('all indexes present')
+        return
+    for index in missing:
+        print('missing\t%s\ton %s (%s)' % (
+            index.name, index.table.name, ', '.join(c.name for c in index.columns)
+        ))
+    if args.create:
+        create_indexes(engine, missing, concurrently=not args.blocking)
+
+def init_db(args):
+    from data_vu.db import create_tables
+
+    create_tables()
+    print('tables created')
+
+def backfill(args):
+    from data_vu.db.material import Material
+
+    for run_id in args.run_ids:
+        start = time.time()
+        updated = Material.backfill_generation_index(
+            run_id, method=args.method, chunk_size=args.chunk_size
+        )
+        print('%8.1fs\t%s\t%s generation_index value(s) updated' % (
+            time.time() - start, run_id, updated
+        ))
+
+def generate(args):
+    from data_vu.files import write_config_file
+    from data_vu.synthetic import generate_run
+
+    if not args.configured_database:
+        from data_vu.benchmark import SCRATCH_DATABASE, bind_database
+        bind_database(args.database or SCRATCH_DATABASE)
+    config = generate_run(
+        args.run_id,
+        generations = args.generations,
+        children_per_generation = args.children,
+        number_of_bins = args.bins,
+        parents_per_generation = args.parents,
+        retest_fraction = args.retest_fraction,
+        seed = args.seed
+    )
+    write_config_file(args.run_id, config)
+    print('generated %s: %s materials' % (
+        args.run_id, args.generations * args.children
+    ))
+
+def benchmark(args):
+    import json
+    from data_vu.benchmark import SCRATCH_DATABASE, run_benchmarks, compare_results
+
+    results = run_benchmarks(
+        scales = args.scales.split(','),
+        repeat = args.repeat,
+        sources = args.sources.split(','),
+        seed = args.seed,
+        output = args.output,
+        database = None if args.configured_database else args.database or SCRATCH_DATABASE
+    )
+    if args.compare != None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = 0
+        for scale, key, old, new, ratio, regressed in compare_results(
+                baseline, results, args.threshold):
+            regressions += regressed
+            print('%-8s%-50s%10.4fs%10.4fs%8.2fx%s' % (
+                scale, key, old, new, ratio, '\tREGRESSED' if regressed else ''
+            ))
+        print('%s regression(s) against %s' % (regressions, args.compare))
+
+def add_scratch_database_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--database', default=None,
+        help = 'connection string of the database to write synthetic runs to '
+               '(default: the scratch SQLite file data_vu_scratch.db)'
+    )
+    group.add_argument(
+        '--configured-database', action='store_true',
+        help = 'write synthetic runs to the database in settings/database.yaml'
+    )
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='data_vu')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    parser_render = commands.add_parser(
+        'render',
+        help = 'render HTSOHM figures for one or more runs'
+    )
+    parser_render.add_argument('run_ids', nargs='+', metavar='run_id')
+    parser_render.add_argument(
+        '-g', '--generations', default='all',
+        help = '`all`(default), or e.g. `0-10`, `0,5,10`'
+    )
+    parser_render.add_argument(
+        '-z', '--z-bins', default='none',
+        help = '`none`(default, all bins at once), `all`, or e.g. `0-4`'
+    )
+    parser_render.add_argument(
+        '-d', '--data-types', default='all',
+        help = '`all`(default), or e.g. `DataPoints,BinCounts`'
+    )
+    parser_render.add_argument(
+        '-a', '--axes', default='all',
+        help = '`all`(default), or e.g. `vf:sa,sa:ml`'
+    )
+    parser_render.add_argument('-w', '--workers', type=int, default=1)
+    parser_render.add_argument('-o', '--output-dir', default=None)
+    parser_render.add_argument(
+        '-f', '--force', action='store_true',
+        help = 're-render figures that are already up to date'
+    )
+    parser_render.add_argument(
+        '--trust-cache', action='store_true',
+        help = 'use cached run data without checking the database'
+    )
+    parser_render.add_argument(
+        '--profile', action='store_true',
+        help = 'report query, draw and save timings per figure (or set DATA_VU_PROFILE=1)'
+    )
+    parser_render.set_defaults(function=render)
+
+    parser_watch = commands.add_parser(
+        'watch',
+        help = 'follow a run in progress, re-rendering changed generations'
+    )
+    parser_watch.add_argument('run_id')
+    parser_watch.add_argument('-z', '--z-bins', default='none')
+    parser_watch.add_argument('-d', '--data-types', default='all')
+    parser_watch.add_argument('-a', '--axes', default='all')
+    parser_watch.add_argument(
+        '-i', '--interval', type=float, default=60,
+        help = 'seconds between polls (default 60)'
+    )
+    parser_watch.add_argument('-o', '--output-dir', default=None)
+    parser_watch.set_defaults(function=watch)
+
+    parser_animate = commands.add_parser(
+        'animate',
+        help = 'save a run\'s generations as an animation (MP4 with ffmpeg, else GIF)'
+    )
+    parser_animate.add_argument('run_id')
+    parser_animate.add_argument('-g', '--generations', default='all')
+    parser_animate.add_argument(
+        '-z', '--z-bin', default='none',
+        help = '`none`(default, all bins at once), or one bin'
+    )
+    parser_animate.add_argument('-d', '--data-types', default='all')
+    parser_animate.add_argument('-a', '--axes', default='all')
+    parser_animate.add_argument('--fps', type=float, default=2)
+    parser_animate.add_argument('--dpi', type=float, default=96)
+    parser_animate.add_argument(
+        '--writer', default=None, choices=['ffmpeg', 'imagemagick', 'pillow']
+    )
+    parser_animate.add_argument('-o', '--output-dir', default=None)
+    parser_animate.set_defaults(function=animate)
+
+    parser_indexes = commands.add_parser(
+        'indexes',
+        help = 'report (and optionally create) indexes missing from the database'
+    )
+    parser_indexes.add_argument(
+        '--create', action='store_true',
+        help = 'create missing indexes (CONCURRENTLY on PostgreSQL)'
+    )
+    parser_indexes.add_argument(
+        '--blocking', action='store_true',
+        help = 'with --create, build with a plain (write-locking) CREATE INDEX'
+    )
+    parser_indexes.set_defaults(function=indexes)
+
+    parser_init_db = commands.add_parser(
+        'init-db',
+        help = 'create the database tables that don\'t exist yet'
+    )
+    parser_init_db.set_defaults(function=init_db)
+
+    parser_backfill = commands.add_parser(
+        'backfill',
+        help = 'fill in materials.generation_index for whole runs'
+    )
+    parser_backfill.add_argument('run_ids', nargs='+', metavar='run_id')
+    parser_backfill.add_argument(
+        '-m', '--method', default=None, choices=['window', 'argsort'],
+        help = 'default: `window` on PostgreSQL, `argsort` elsewhere'
+    )
+    parser_backfill.add_argument(
+        '-c', '--chunk-size', type=int, default=None,
+        help = 'commit about every this many rows (default: one transaction)'
+    )
+    parser_backfill.set_defaults(function=backfill)
+
+    parser_generate = commands.add_parser(
+        'generate',
+        help = 'populate the database with a synthetic run'
+    )
+    parser_generate.add_argument('run_id')
+    parser_generate.add_argument('-g', '--generations', type=int, default=10)
+    parser_generate.add_argument('-c', '--children', type=int, default=100,
+        help = 'children per generation (default 100)')
+    parser_generate.add_argument('-b', '--bins', type=int, default=10,
+        help = 'bins per axis (default 10)')
+    parser_generate.add_argument('-p', '--parents', type=int, default=None,
+        help = 'distinct parents per generation (default children / 10)')
+    parser_generate.add_argument('--retest-fraction', type=float, default=0.)
+    parser_generate.add_argument('--seed', type=int, default=0)
+    add_scratch_database_arguments(parser_generate)
+    parser_generate.set_defaults(function=generate)
+
+    parser_benchmark = commands.add_parser(
+        'benchmark',
+        help = 'time queries and plots against synthetic runs'
+    )
+    parser_benchmark.add_argument(
+        '-s', '--scales', default='small,medium',
+        help = '`small`, `medium`, `large` (default `small,medium`)'
+    )
+    parser_benchmark.add_argument('-r', '--repeat', type=int, default=3)
+    parser_benchmark.add_argument(
+        '--sources', default='database,run_data,summary',
+        help = 'where queries are answered from (default all)'
+    )
+    parser_benchmark.add_argument('--seed', type=int, default=0)
+    parser_benchmark.add_argument('-o', '--output', default=None,
+        help = 'save results as JSON')
+    parser_benchmark.add_argument('--compare', default=None,
+        help = 'JSON results of an earlier benchmark to compare against')
+    parser_benchmark.add_argument('--threshold', type=float, default=1.1,
+        help = 'slowdown ratio reported as a regression (default 1.1)')
+    add_scratch_database_arguments(parser_benchmark)
+    parser_benchmark.set_defaults(function=benchmark)
+
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.function(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import numpy as np
+
+from data_vu.utilities import *
+
+REQUIRED_KEYS = [
+    'number_of_convergence_bins',
+    'methane_loading_limits',
+    'surface_area_limits',
+    'void_fraction_limits'
+]
+
+class RunContext(object):
+    """Everything about one run that doesn't change from panel to panel.
+
+    The run's config is loaded and validated once, and axis limits and bin
+    widths are precomputed, so plotting and query functions that are passed
+    a context don't read files or re-derive them per panel. Optionally
+    carries the run's `RunData` and `RunSummary`.
+
+    """
+
+    def __init__(self, run_id, config=None, run_data=None, summary=None):
+        if config == None:
+            config = load_config_file(run_id)
+        missing = [key for key in REQUIRED_KEYS if key not in config]
+        if len(missing) > 0:
+            raise KeyError('config for %s is missing: %s' % (run_id, ', '.join(missing)))
+
+        self.run_id = run_id
+        self.config = config
+        self.number_of_bins = config['number_of_convergence_bins']
+        self.initial_strength = config.get('initial_mutation_strength', np.nan)
+        self.limits = {}
+        self.widths = {}
+        for axis, key in LIMITS.items():
+            limits = config[key]
+            self.limits[axis] = limits
+            self.widths[axis] = (limits[1] - limits[0]) / self.number_of_bins
+        self.run_data = run_data
+        self.summary = summary
+
+    def get_limits(self, x):
+        return self.limits[x[:2]]
+
+    def get_width(self, x):
+        return self.widths[x[:2]]
@@ -1,29 +1,184 @@
 # from htsohm.db.runDB_declarative import *
 
 # standard library imports
+import contextlib
 import os
+import threading
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
 import yaml
 
-# Init the database
-with open(os.path.join('settings', 'database.yaml'), 'r') as yaml_file:
-    dbconfig = yaml.load(yaml_file)
-connection_string = dbconfig['connection_string']
-if 'sqlite' in connection_string:
-    print(
-        'WARNING: attempting to use SQLite database! Okay for local debugging\n' +
-        'but will not work with multiple workers, due to lack of locking features.'
+# pool settings; override any of them under `pool:` in settings/database.yaml
+POOL_DEFAULTS = {
+    'pool_size' : 5,
+    'max_overflow' : 10,
+    'pool_timeout' : 30,
+    'pool_pre_ping' : True,     # test connections on checkout, replace dead ones
+    'pool_recycle' : 3600       # seconds; reconnect before server-side idle timeouts
+}
+
+def make_engine(connection_string, **pool_options):
+    """Creates an engine with a bounded, self-healing connection pool.
+
+    Args:
+        connection_string (str): sqlalchemy database URL.
+        **pool_options: override `POOL_DEFAULTS`.
+
+    """
+    options = dict(POOL_DEFAULTS)
+    options.update(pool_options)
+    if connection_string.startswith('sqlite'):
+        # SQLite gets a Null/SingletonThreadPool, which isn't sized
+        for key in ['pool_size', 'max_overflow', 'pool_timeout']:
+            options.pop(key)
+    return create_engine(connection_string, **options)
+
+def find_database_config():
+    """Returns the path of the database settings file.
+
+    Looked up, in order: `$DATA_VU_DATABASE_CONFIG`; `settings/database.yaml`
+    under the working directory; `settings/database.yaml` next to the
+    `data_vu` package (the repository root).
+
+    """
+    if 'DATA_VU_DATABASE_CONFIG' in os.environ:
+        return os.environ['DATA_VU_DATABASE_CONFIG']
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    candidates = [
+        os.path.join('settings', 'database.yaml'),
+        os.path.join(package_root, 'settings', 'database.yaml')
+    ]
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(
+        'no database settings: set DATA_VU_DATABASE_URL or DATA_VU_DATABASE_CONFIG, '
+        'or create one of %s' % ', '.join(candidates)
     )
-engine = create_engine(connection_string)
-session = sessionmaker(bind=engine)()
+
+def load_database_config():
+    """Reads the connection string (`$DATA_VU_DATABASE_URL` takes precedence
+    over the settings file) and pool settings.
+    """
+    if 'DATA_VU_DATABASE_URL' in os.environ:
+        return {'connection_string' : os.environ['DATA_VU_DATABASE_URL']}
+    with open(find_database_config(), 'r') as yaml_file:
+        return yaml.safe_load(yaml_file)
+
+# The engine is created on first use (see `get_engine`), not at import, so
+# importing data_vu doesn't read settings or touch the database. The lock
+# makes threads that query for the first time at once share one engine (and
+# pool).
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Returns the engine, creating it from the database settings on first
+    call.
+    """
+    global _engine
+    if _engine == None:
+        with _engine_lock:
+            if _engine == None:
+                dbconfig = load_database_config()
+                connection_string = dbconfig['connection_string']
+                if 'sqlite' in connection_string:
+                    print(
+                        'WARNING: attempting to use SQLite database! Okay for local debugging\n' +
+                        'but will not work with multiple workers, due to lack of locking features.'
+                    )
+                engine = make_engine(connection_string, **dbconfig.get('pool', {}))
+                Base.metadata.bind = engine
+                _engine = engine
+    return _engine
+
+def __getattr__(name):
+    # `from data_vu.db import engine` still works, and creates the engine
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+class _LazySessionFactory(sessionmaker):
+    def __call__(self, **local_kw):
+        if self.kw.get('bind') == None and local_kw.get('bind') == None:
+            self.configure(bind=get_engine())
+        return super(_LazySessionFactory, self).__call__(**local_kw)
+
+# `session` is a thread-local proxy: each thread gets its own session (and
+# connection), so data_vu can be queried from several threads at once. A
+# thread should call `session.remove()` when it's done, to return its
+# connection to the pool.
+Session = scoped_session(_LazySessionFactory())
+session = Session
+
+def configure(connection_string, **pool_options):
+    """Switches data_vu to another database, e.g. a scratch SQLite file.
+
+    Sessions already open are discarded and the old engine's pool is closed.
+
+    """
+    global _engine
+    with _engine_lock:
+        old_engine = _engine
+        _engine = make_engine(connection_string, **pool_options)
+        Session.remove()
+        Session.configure(bind=_engine)
+        Base.metadata.bind = _engine
+    if old_engine != None:
+        old_engine.dispose()
+    return _engine
+
+def create_tables(tables=None):
+    """Creates tables that don't exist yet (all of data_vu's models, by
+    default). Nothing is created implicitly; run this, or
+    `python -m data_vu init-db`, once per database.
+
+    Args:
+        tables (list): optional, `sqlalchemy.Table` objects.
+
+    """
+    Base.metadata.create_all(get_engine(), tables=tables)
+
+def connect():
+    """Checks a connection out of the pool; use as
+
+        with connect() as connection:
+            connection.execute(...)
+
+    so it's returned to the pool even if the block raises.
+
+    """
+    return get_engine().connect()
+
+@contextlib.contextmanager
+def session_scope():
+    """A session of its own (not the shared thread-local one), committed if
+    the block succeeds, rolled back if it raises, and always closed.
+    """
+    new_session = Session.session_factory()
+    try:
+        yield new_session
+        new_session.commit()
+    except:
+        new_session.rollback()
+        raise
+    finally:
+        new_session.close()
+
+def _after_fork_in_child():
+    # A forked child inherits the parent's sockets. Drop its session and pool
+    # without closing anything (that would close the parent's connections);
+    # the child opens its own connections on first use.
+    Session.registry.clear()
+    if _engine != None:
+        _engine.dispose(close=False)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
 
 # Import all models
 from data_vu.db.base import Base
 from data_vu.db.material import Material
 from data_vu.db.mutation_strength import MutationStrength
-
-# Create tables in the engine, if they don't exist already.
-Base.metadata.create_all(engine)
-Base.metadata.bind = engine
+from data_vu.db.material_summary import MaterialSummary, SummaryState
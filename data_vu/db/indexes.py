@@ -0,0 +1,65 @@
+from sqlalchemy import inspect
+from sqlalchemy.sql import text
+
+from data_vu.db.base import Base
+
+def find_missing_indexes(engine):
+    """Compares the indexes declared on the models with an existing database.
+
+    Args:
+        engine: sqlalchemy engine.
+
+    Returns:
+        missing (list): declared `sqlalchemy.Index` objects whose name doesn't
+            exist on the database (tables that don't exist are skipped).
+
+    """
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = [index['name'] for index in inspector.get_indexes(table.name)]
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                missing.append(index)
+    return missing
+
+def get_create_statement(index, engine, concurrently=True):
+    """Returns the CREATE INDEX statement for one index.
+
+    On PostgreSQL the index is built CONCURRENTLY (if requested), so a live
+    table isn't locked against writes while it builds.
+
+    """
+    preparer = engine.dialect.identifier_preparer
+    concurrently = concurrently and engine.dialect.name == 'postgresql'
+    return 'CREATE INDEX %sIF NOT EXISTS %s ON %s (%s)' % (
+        'CONCURRENTLY ' if concurrently else '',
+        preparer.quote(index.name),
+        preparer.format_table(index.table),
+        ', '.join(preparer.quote(column.name) for column in index.columns)
+    )
+
+def create_indexes(engine, indexes, concurrently=True):
+    """Creates indexes on an existing database, one at a time.
+
+    CREATE INDEX CONCURRENTLY can't run inside a transaction, so each
+    statement is executed on an autocommit connection.
+
+    Args:
+        engine: sqlalchemy engine.
+        indexes (list): `sqlalchemy.Index` objects, see `find_missing_indexes`.
+        concurrently (bool): build without blocking writes (PostgreSQL only).
+
+    Returns:
+        None
+
+    """
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        for index in indexes:
+            statement = get_create_statement(index, engine, concurrently)
+            print(statement)
+            connection.execute(text(statement))
@@ -2,10 +2,11 @@
 import sys
 import uuid
 
-from sqlalchemy import Column, ForeignKey, Integer, String, Float, Boolean
+from sqlalchemy import Column, ForeignKey, Integer, String, Float, Boolean, Index
+from sqlalchemy import and_, bindparam, case, func, not_, or_
 from sqlalchemy.sql import text
 
-from data_vu.db import Base, session, engine
+from data_vu.db import Base, session, connect
 
 class Material(Base):
     __tablename__ = 'materials'
@@ -50,6 +51,13 @@ class Material(Base):
     surface_area_bin = Column(Integer)                     # dimm.
     void_fraction_bin = Column(Integer)                    # dimm.
 
+    __table_args__ = (
+        # queries filter on run_id + generation, then group on the bins
+        Index('ix_materials_run_id_generation_bins', 'run_id', 'generation',
+              'methane_loading_bin', 'surface_area_bin', 'void_fraction_bin'),
+        # children -> parent joins go through the primary key; this is for parent -> children
+        Index('ix_materials_parent_id', 'parent_id'),
+    )
 
     def __init__(self, run_id=None, ):
         self.uuid = str(uuid.uuid4())
@@ -66,6 +74,108 @@ class Material(Base):
                 Material.id < self.id,
             ).count()
 
+    @classmethod
+    def backfill_generation_index(cls, run_id, method=None, chunk_size=None):
+        """
+        Sets generation_index for every material in a run at once: the same 0-based position, by
+        id, within the material's generation as calculate_generation_index, without a COUNT query
+        per row. Only rows whose generation_index changes are written.
+
+        method 'window' runs one UPDATE numbering rows with ROW_NUMBER() (the default on
+        PostgreSQL); 'argsort' reads (id, generation) pairs, numbers them with numpy and writes
+        them back by id (the default elsewhere, e.g. SQLite). With chunk_size, changes are
+        committed about every chunk_size rows instead of in one transaction, so locks are held
+        briefly: 'window' updates runs of whole generations per transaction, 'argsort' rows.
+        Returns the number of rows changed.
+        """
+        if method == None:
+            method = 'window' if session.get_bind().dialect.name == 'postgresql' else 'argsort'
+        if method == 'window':
+            updated = cls._backfill_generation_index_window(run_id, chunk_size)
+        elif method == 'argsort':
+            updated = cls._backfill_generation_index_argsort(run_id, chunk_size)
+        else:
+            raise ValueError("method must be 'window' or 'argsort', not %r" % method)
+        session.commit()
+        return updated
+
+    @classmethod
+    def _backfill_generation_index_window(cls, run_id, chunk_size=None):
+        sql = text("""
+            update materials
+            set generation_index = ranked.generation_index
+            from (
+                select
+                    id,
+                    row_number() over (partition by generation order by id) - 1 as generation_index
+                from materials
+                where run_id = :run_id
+                  and generation between :first and :last
+            ) as ranked
+            where materials.id = ranked.id
+              and (materials.generation_index is null or
+                   materials.generation_index <> ranked.generation_index)
+        """)
+
+        counts = session.query(cls.generation, func.count(cls.id)) \
+                .filter(cls.run_id == run_id, cls.generation != None) \
+                .group_by(cls.generation) \
+                .order_by(cls.generation) \
+                .all()
+        if len(counts) == 0:
+            return 0
+        if chunk_size == None:
+            chunks = [(counts[0][0], counts[-1][0])]
+        else:
+            chunks = []
+            first, rows = counts[0][0], 0
+            for generation, count in counts:
+                if rows > 0 and rows + count > chunk_size:
+                    chunks.append((first, previous))
+                    first, rows = generation, 0
+                rows += count
+                previous = generation
+            chunks.append((first, previous))
+
+        updated = 0
+        for first, last in chunks:
+            updated += session.execute(sql, {'run_id' : run_id, 'first' : first, 'last' : last}).rowcount
+            if chunk_size != None:
+                session.commit()
+        return updated
+
+    @classmethod
+    def _backfill_generation_index_argsort(cls, run_id, chunk_size=None):
+        import numpy as np
+        from data_vu.utilities import stream_array
+
+        query = session.query(cls.id, cls.generation, cls.generation_index) \
+                .filter(cls.run_id == run_id, cls.generation != None)
+        rows = stream_array(query, 3)
+        ids, generations, current = rows[:, 0], rows[:, 1], rows[:, 2]
+
+        order = np.lexsort((ids, generations))
+        generations = generations[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(generations)) + 1]
+        lengths = np.diff(np.r_[starts, len(order)])
+        indexes = np.arange(len(order)) - np.repeat(starts, lengths)
+        changed = current[order] != indexes    # NULL (NaN) always differs
+        ids = ids[order][changed].astype(np.int64)
+        indexes = indexes[changed]
+
+        statement = cls.__table__.update() \
+                .where(cls.__table__.c.id == bindparam('material_id')) \
+                .values(generation_index=bindparam('new_generation_index'))
+        step = chunk_size if chunk_size != None else max(len(ids), 1)
+        for start in range(0, len(ids), step):
+            session.execute(statement, [
+                {'material_id' : int(id), 'new_generation_index' : int(index)}
+                for id, index in zip(ids[start:start + step], indexes[start:start + step])
+            ])
+            if chunk_size != None:
+                session.commit()
+        return len(ids)
+
     def calculate_percent_children_in_bin(self):
         sql = text("""
             select
@@ -79,19 +189,22 @@ class Material(Base):
                 ) as in_bin
             from materials m
             join materials p on (m.parent_id = p.id)
-            where m.generation = :gen
+            where m.run_id = :run_id
+              and m.generation = :gen
               and p.methane_loading_bin = :ml_bin
               and p.surface_area_bin = :sa_bin
               and p.void_fraction_bin = :vf_bin
         """)
 
-        rows = engine.connect().execute(
-            sql,
-            gen=self.generation,
-            ml_bin=self.methane_loading_bin,
-            sa_bin=self.surface_area_bin,
-            vf_bin=self.void_fraction_bin
-        ).fetchall()
+        with connect() as connection:
+            rows = connection.execute(
+                sql,
+                run_id=self.run_id,
+                gen=self.generation,
+                ml_bin=self.methane_loading_bin,
+                sa_bin=self.surface_area_bin,
+                vf_bin=self.void_fraction_bin
+            ).fetchall()
 
         return len([ r for r in rows if r.in_bin ]) / len(rows)
 
@@ -109,3 +222,24 @@ class Material(Base):
                          abs(vf_mean - vf_o) >= tolerance * vf_o)
 
         return not retest_failed
+
+    @classmethod
+    def retest_passed_clause(cls, tolerance):
+        """
+        SQL version of calculate_retest_result, for bulk UPDATEs: true unless a retest mean differs
+        from the initially-calculated value by tolerance (as a fraction of it) or more, and NULL
+        (not evaluated) if any of the values it compares is NULL.
+        """
+        pairs = [
+            (cls.retest_methane_loading_sum, cls.ml_absolute_volumetric_loading),
+            (cls.retest_surface_area_sum, cls.sa_volumetric_surface_area),
+            (cls.retest_void_fraction_sum, cls.vf_helium_void_fraction)
+        ]
+        inputs = [cls.retest_num] + [column for pair in pairs for column in pair]
+        return case((
+            and_(*[column != None for column in inputs]),
+            not_(or_(*[
+                func.abs(retest_sum / cls.retest_num - original) >= tolerance * original
+                for retest_sum, original in pairs
+            ]))
+        ))
@@ -0,0 +1,41 @@
+from sqlalchemy import Column, Integer, String, Float, PrimaryKeyConstraint
+
+from data_vu.db import Base
+
+class MaterialSummary(Base):
+    """Per-generation, per-bin aggregate of `materials`, maintained by
+    `data_vu.summary.refresh_summary`.
+    """
+    __tablename__ = 'material_summaries'
+    # COLUMN                                                 UNITS
+    run_id = Column(String(50))                            # dimm.
+    generation = Column(Integer)                           # generation#
+    methane_loading_bin = Column(Integer)                  # dimm.
+    surface_area_bin = Column(Integer)                     # dimm.
+    void_fraction_bin = Column(Integer)                    # dimm.
+    count = Column(Integer)                                # materials
+
+    ml_min = Column(Float)                                 # cm^3 / cm^3
+    ml_max = Column(Float)                                 # cm^3 / cm^3
+    ml_mean = Column(Float)                                # cm^3 / cm^3
+    ml_count = Column(Integer)                             # materials with ml set
+    sa_min = Column(Float)                                 # m^2 / cm^3
+    sa_max = Column(Float)                                 # m^2 / cm^3
+    sa_mean = Column(Float)                                # m^2 / cm^3
+    sa_count = Column(Integer)                             # materials with sa set
+    vf_min = Column(Float)                                 # dimm.
+    vf_max = Column(Float)                                 # dimm.
+    vf_mean = Column(Float)                                # dimm.
+    vf_count = Column(Integer)                             # materials with vf set
+
+    __table_args__ = (
+        PrimaryKeyConstraint('run_id', 'generation', 'methane_loading_bin', 'surface_area_bin', 'void_fraction_bin'),
+    )
+
+class SummaryState(Base):
+    """High-water mark: the newest material id seen by the last refresh.
+    Generations of materials above it are recomputed by the next one.
+    """
+    __tablename__ = 'material_summary_states'
+    run_id = Column(String(50), primary_key=True)          # dimm.
+    max_material_id = Column(Integer)                      # dimm.
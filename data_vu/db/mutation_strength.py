@@ -1,7 +1,6 @@
-import os
-
-import yaml
-from sqlalchemy import Column, ForeignKey, Integer, String, Float, Boolean, PrimaryKeyConstraint
+from sqlalchemy import Column, ForeignKey, Integer, String, Float, Boolean, PrimaryKeyConstraint, Index
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Query
 
 from data_vu import config
 from data_vu.db import Base, session
@@ -18,6 +17,9 @@ class MutationStrength(Base):
 
     __table_args__ = (
         PrimaryKeyConstraint('run_id', 'generation', 'methane_loading_bin', 'surface_area_bin', 'void_fraction_bin'),
+        # get_prior looks up one bin's latest generation; the primary key leads with generation
+        Index('ix_mutation_strengths_run_id_bins_generation', 'run_id', 'methane_loading_bin',
+              'surface_area_bin', 'void_fraction_bin', 'generation'),
     )
 
     def __init__(self, run_id=None, generation=None, methane_loading_bin=None,
@@ -51,3 +53,63 @@ class MutationStrength(Base):
         else:
             return MutationStrength(run_id, generation, methane_loading_bin, surface_area_bin,
                                     void_fraction_bin, config['initial_mutation_strength'])
+
+    @classmethod
+    def get_prior_grid(cls, run_id, generation, number_of_bins, initial_strength=None):
+        """
+        Looks up the most recent mutation_strength for every bin at or before the passed generation
+        with a single query, and returns them as a dense array indexed
+        [methane_loading_bin, surface_area_bin, void_fraction_bin]. Bins without a row get the
+        initial mutation strength (NaN if it isn't configured).
+        """
+        query = cls.prior_grid_query(run_id, generation, session.get_bind().dialect.name)
+        rows = query.with_session(session()).all()
+        return cls.fill_prior_grid(rows, number_of_bins, initial_strength)
+
+    @classmethod
+    def prior_grid_query(cls, run_id, generation, dialect_name):
+        """
+        Builds the query behind get_prior_grid, not bound to a session: [bins..., strength] rows
+        of the latest generation at or before the passed one, for each bin. `query.statement`
+        runs the same SQL on an async connection (see data_vu.async_queries).
+        """
+        bins = [cls.methane_loading_bin, cls.surface_area_bin, cls.void_fraction_bin]
+
+        if dialect_name == 'postgresql':
+            return Query(bins + [cls.strength]) \
+                    .filter(
+                        cls.run_id == run_id,
+                        cls.generation <= generation) \
+                    .distinct(*bins) \
+                    .order_by(*(bins + [cls.generation.desc()]))
+        latest = Query(bins + [func.max(cls.generation).label('generation')]) \
+                .filter(
+                    cls.run_id == run_id,
+                    cls.generation <= generation) \
+                .group_by(*bins) \
+                .subquery()
+        return Query(bins + [cls.strength]) \
+                .join(latest, and_(
+                    cls.run_id == run_id,
+                    cls.generation == latest.c.generation,
+                    cls.methane_loading_bin == latest.c.methane_loading_bin,
+                    cls.surface_area_bin == latest.c.surface_area_bin,
+                    cls.void_fraction_bin == latest.c.void_fraction_bin))
+
+    @classmethod
+    def fill_prior_grid(cls, rows, number_of_bins, initial_strength=None):
+        """
+        Scatters prior_grid_query rows into the dense array get_prior_grid returns.
+        """
+        import numpy as np
+
+        if initial_strength == None:
+            initial_strength = config.get('initial_mutation_strength', np.nan)
+        grid = np.full((number_of_bins,) * 3, initial_strength, dtype=float)
+        if len(rows) > 0:
+            rows = np.array(rows, dtype=float)
+            coords = rows[:, :3].astype(int)
+            in_range = ((coords >= 0) & (coords < number_of_bins)).all(axis=1)
+            coords = coords[in_range]
+            grid[coords[:, 0], coords[:, 1], coords[:, 2]] = rows[in_range, 3]
+        return grid
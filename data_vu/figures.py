@@ -1,11 +1,18 @@
+import multiprocessing
 import os
+import time
 
-import matplotlib.pyplot as plt
+import numpy as np
 
 from data_vu.utilities import *
 from data_vu.queries import *
 from data_vu.files import load_config_file
 from data_vu.plotting import *
+from data_vu.run_data import RunData
+from data_vu.summary import RunSummary
+from data_vu.context import RunContext
+from data_vu.profiling import profiling, time_panel, time_phase, format_report, write_report
+from data_vu.db import session
 
 def plot_HTSOHM(
         run_id,
@@ -19,7 +26,13 @@ def plot_HTSOHM(
         ],
         labels = 'first_only',
         highlight_parents = 'on',
-        highlight_children = 'on'
+        highlight_children = 'on',
+        preload = 'on',
+        cache = 'on',
+        point_style = 'scatter',
+        workers = 1,
+        profile = None,
+        prefetch = 0
     ):
     """Creates subplot figures for different axes and data-types.
 
@@ -33,6 +46,22 @@ def plot_HTSOHM(
         labels (str): `first_only`(default), `all`, None.
         highlight_parents (str): `on`(default), `off`.
         highlight_children (str): `on`(default), `off`.
+        preload (str): `on`(default), load the whole run into memory with one
+            query and answer every panel from it; `summary`, refresh and read
+            bin-counts from `material_summaries`; `off`, query per panel.
+        cache (str): `on`(default), `trust`, `off`; how preloaded run data
+            uses the local cache, see `data_vu.run_data.RunData.load`.
+        point_style (str): `scatter`(default), `rasterized`, `density`; see
+            `data_vu.plotting.plot_points`.
+        workers (int): render figures in a pool of this many processes (Agg
+            backend); 1(default) renders serially. Workers share the preloaded
+            run data instead of re-querying.
+        profile (bool): report timings for every figure, see
+            `plot_figure`; defaults to the `DATA_VU_PROFILE` env var.
+        prefetch (int): with preload `off` and one worker, query this many
+            panels ahead, asynchronously, while the current one is drawn; see
+            `data_vu.async_queries.Prefetcher` (needs an async database
+            driver). 0(default) queries each panel when it's drawn.
 
     Returns:
         None
@@ -40,8 +69,16 @@ def plot_HTSOHM(
     """
     config = load_config_file(run_id)
 
+    run_data = None
+    if preload == 'on':
+        run_data = RunData.load(run_id, cache=cache)
+        run_data.get_bin_count_tensor(config['number_of_convergence_bins'])
+    summary = None
+    if preload == 'summary':
+        summary = RunSummary(run_id)
+
     if generations == 'all':
-        generations = [ i for i in range( count_generations(run_id) ) ]
+        generations = [ i for i in range( count_generations(run_id, run_data) ) ]
     if z_bins == 'all':
         z_bins = [ i for i in range( config['number_of_convergence_bins'] ) ]
     if data_types == 'all':
@@ -57,42 +94,263 @@ def plot_HTSOHM(
     z_bins = make_list(z_bins)
     data_types = make_list(data_types)
 
-    for data_type in data_types:
-        print('Plotting %s...' % data_type)
+    context = RunContext(run_id, config, run_data, summary)
+    if run_data != None and 'MutationStrengths' in data_types:
+        run_data.get_strength_history(context.number_of_bins, context.initial_strength)
 
-        for [x, y] in axes:
-            print('\t%s v %s' % (x, y))
+    options = dict(
+        labels = labels,
+        highlight_parents = highlight_parents,
+        highlight_children = highlight_children,
+        point_style = point_style,
+        profile = profile
+    )
+    figures = [
+        (data_type, x, y)
+        for data_type in data_types
+        for [x, y] in axes
+    ]
 
-            fig = plt.figure(
-                figsize = ( 2 * len(generations), 2 * len(z_bins) )
+    if workers > 1:
+        # forked workers drop the inherited pool, see data_vu.db
+        session.remove()
+        pool = multiprocessing.Pool(
+            workers,
+            initializer = _init_worker,
+            initargs = (context,)
+        )
+        try:
+            results = pool.imap(
+                _plot_figure_in_worker,
+                [
+                    (data_type, x, y, generations, z_bins, options)
+                    for (data_type, x, y) in figures
+                ]
             )
-            fig_title = '%s\n' % run_id + \
-                'gen. %s thru %s\n' % (generations[0], generations[-1]) + \
-                'bin %s thru %s' % (z_bins[0], z_bins[-1])
-            fig.suptitle(fig_title)
+            for (data_type, x, y), file_name in zip(figures, results):
+                print('%s\t%s v %s\t%s' % (data_type, x, y, file_name))
+        finally:
+            pool.close()
+            pool.join()
+    elif prefetch > 0 and run_data == None and summary == None:
+        from data_vu.async_queries import Prefetcher, get_panel_queries
+
+        with Prefetcher(context, prefetch) as prefetcher:
+            for data_type, x, y in figures:
+                for generation in generations:
+                    for z_bin in z_bins:
+                        prefetcher.add_panel(get_panel_queries(
+                            data_type, x, y, z_bin, run_id, generation,
+                            highlight_parents, highlight_children
+                        ))
+            for data_type, x, y in figures:
+                plot_figure(
+                    context, data_type, x, y,
+                    generations, z_bins,
+                    **options
+                )
+    else:
+        for data_type, x, y in figures:
+            plot_figure(
+                context, data_type, x, y,
+                generations, z_bins,
+                **options
+            )
+    print('...done!')
+
+def watch_HTSOHM(
+        run_id,
+        z_bins,
+        data_types,
+        axes = [
+            ['vf', 'sa'],
+            ['vf', 'ml'],
+            ['sa', 'ml']
+        ],
+        interval = 60,
+        max_polls = None,
+        labels = 'first_only',
+        highlight_parents = 'on',
+        highlight_children = 'on',
+        point_style = 'scatter',
+        output_dir = None
+    ):
+    """Follows a run in progress, re-rendering figures as materials arrive.
+
+    Each generation is saved as its own figure (one column, z_bins as rows).
+    Every `interval` seconds the run is polled for materials past the last
+    seen id; only figures for generations whose inputs changed (the
+    generations with new rows, and later ones) are re-rendered. BinCounts
+    colours are scaled by the max count at the time a figure is rendered.
 
-            for generation in generations:
+    Args:
+        run_id (str): run identification string.
+        z_bins (str, int, <class 'list'>): `all`, None, [0, 1, 2, ...], etc.
+        data_types (str, <class 'list'>): `all`, `DataPoints`, `BinCounts`,
+            `MutationStrengths`, or list of these.
+        axes (<class 'list'>): ex. [['vf', 'sa'], ['vf', 'ml'], ['sa', 'ml']]
+        interval (float): seconds between polls.
+        max_polls (int): stop after this many polls; None(default) runs until
+            interrupted.
+        labels (str): `first_only`(default), `all`, None.
+        highlight_parents (str): `on`(default), `off`.
+        highlight_children (str): `on`(default), `off`.
+        point_style (str): see `data_vu.plotting.plot_points`.
+        output_dir (str): directory to save in; defaults to the working
+            directory.
+
+    Returns:
+        None
+
+    """
+    context = RunContext(run_id)
+    number_of_bins = context.number_of_bins
+    initial_strength = context.initial_strength
+
+    if z_bins == 'all':
+        z_bins = [ i for i in range( number_of_bins ) ]
+    if data_types == 'all':
+        data_types = ['DataPoints', 'BinCounts', 'MutationStrengths']
+    z_bins = make_list(z_bins)
+    data_types = make_list(data_types)
+
+    run_data = context.run_data = RunData.load(run_id, cache='off')
+    run_data.get_bin_count_tensor(number_of_bins)
+    if 'MutationStrengths' in data_types:
+        run_data.get_strength_history(number_of_bins, initial_strength)
+    changed = sorted(set(int(gen) for gen in np.unique(run_data.generation) if gen >= 0))
+
+    polls = 0
+    try:
+        while True:
+            if len(changed) > 0:
+                last_generation = run_data.count_generations()
+                if 'MutationStrengths' in data_types:
+                    run_data.get_strength_history(number_of_bins, initial_strength)
+                for generation in range(changed[0], last_generation + 1):
+                    for data_type in data_types:
+                        for [x, y] in axes:
+                            file_name = plot_figure(
+                                context, data_type, x, y,
+                                [generation], z_bins,
+                                labels = labels,
+                                highlight_parents = highlight_parents,
+                                highlight_children = highlight_children,
+                                point_style = point_style,
+                                verbose = False,
+                                output_dir = output_dir
+                            )
+                            print('updated\t%s' % file_name)
+
+            polls += 1
+            if max_polls != None and polls >= max_polls:
+                break
+            time.sleep(interval)
+            changed = run_data.update()
+    except KeyboardInterrupt:
+        pass
+
+_worker_context = None
+
+def _init_worker(context):
+    import matplotlib.pyplot as plt
+
+    global _worker_context
+    plt.switch_backend('Agg')
+    _worker_context = context
+
+def _plot_figure_in_worker(args):
+    data_type, x, y, generations, z_bins, options = args
+    return plot_figure(
+        _worker_context, data_type, x, y,
+        generations, z_bins,
+        verbose = False,
+        **options
+    )
+
+def plot_figure(
+        context,
+        data_type,
+        x, y,
+        generations,
+        z_bins,
+        labels = 'first_only',
+        highlight_parents = 'on',
+        highlight_children = 'on',
+        point_style = 'scatter',
+        verbose = True,
+        output_dir = None,
+        profile = None
+    ):
+    """Creates and saves one subplot figure: generations as columns, z_bins as
+        rows.
+
+    Args:
+        context (RunContext): the run's config, and optionally its run_data
+            and summary.
+        data_type (str): `DataPoints`, `BinCounts`, `MutationStrengths`.
+        x (str): `ml`, `sa`, `vf`.
+        y (str): `ml`, `sa`, `vf`.
+        generations (<class 'list'>): [0, 1, 2, ...], etc.
+        z_bins (<class 'list'>): [None], [0, 1, 2, ...], etc.
+        labels (str): `first_only`(default), `all`, None.
+        highlight_parents (str): `on`(default), `off`.
+        highlight_children (str): `on`(default), `off`.
+        point_style (str): see `data_vu.plotting.plot_points`.
+        verbose (bool): print progress.
+        output_dir (str): directory to save in; defaults to the working
+            directory.
+        profile (bool): time SQL, query, draw and save phases per panel,
+            print a table and save it as `<file_name>_profile.json`; defaults
+            to the `DATA_VU_PROFILE` env var.
+
+    Returns:
+        file_name (str): path of the saved figure.
+
+    """
+    import matplotlib.pyplot as plt
+
+    run_id = context.run_id
+    config = context.config
+
+    with profiling(profile) as profiler:
+        if verbose:
+            print('Plotting %s...' % data_type)
+            print('\t%s v %s' % (x, y))
+
+        fig = plt.figure(
+            figsize = ( 2 * len(generations), 2 * len(z_bins) )
+        )
+        fig_title = '%s\n' % run_id + \
+            'gen. %s thru %s\n' % (generations[0], generations[-1]) + \
+            'bin %s thru %s' % (z_bins[0], z_bins[-1])
+        fig.suptitle(fig_title)
+
+        for generation in generations:
+            if verbose:
                 print('\t\tgeneration:\t%s' % generation)
 
-                for z_bin in z_bins:
+            for z_bin in z_bins:
+                if verbose:
                     print('\t\t\tz_bin:\t%s' % z_bin)
 
-                    rows = len(z_bins)
-                    row = z_bins.index(z_bin) + 1
-                    if z_bins == None or len(z_bins) == 1:
-                        row = rows = 1
+                rows = len(z_bins)
+                row = z_bins.index(z_bin) + 1
+                if z_bins == None or len(z_bins) == 1:
+                    row = rows = 1
 
-                    columns = len(generations)
-                    column = generations.index(generation) + 1
-                    if len(generations) == 1:
-                        column = columns = 1
+                columns = len(generations)
+                column = generations.index(generation) + 1
+                if len(generations) == 1:
+                    column = columns = 1
 
+                with time_panel(generation, z_bin):
                     ax = plt.subplot(
                         rows,
                         columns,
                         (row - 1) * columns + column
                     )
-                    
+
                     if data_type == 'DataPoints':
                         plot_points(
                             x, y, z_bin,
@@ -100,7 +358,9 @@ def plot_HTSOHM(
                             config, ax, z_bins, generations,
                             labels,
                             highlight_children,
-                            highlight_parents
+                            highlight_parents,
+                            point_style = point_style,
+                            context = context
                         )
 
                     elif data_type == 'BinCounts':
@@ -112,7 +372,8 @@ def plot_HTSOHM(
                             config, ax, z_bins, generations,
                             labels,
                             highlight_children,
-                            highlight_parents
+                            highlight_parents,
+                            context = context
                         )
 
                     elif data_type == 'MutationStrengths':
@@ -124,16 +385,31 @@ def plot_HTSOHM(
                             config, ax, z_bins, generations,
                             labels,
                             highlight_children,
-                            highlight_parents
+                            highlight_parents,
+                            context = context
                         )
 
+        file_name = get_figure_file_name(run_id, data_type, x, y, generations, z_bins, output_dir)
+        with time_phase('save'):
             plt.savefig(
-                '%s_%s_%s_%s_' % (run_id, x, y, data_type) +
-                    'bins%sto%s_' % (z_bins[0], z_bins[-1]) +
-                    'gens%sto%s.png' % (generations[0], generations[-1]),
+                file_name,
                 bbox_inches = 'tight',
                 pad_inches = 0,
                 dpi = 96 * 8
             )
-            plt.cla()
-    print('...done!')
+        plt.close(fig)
+
+        if profiler != None:
+            report = profiler.report(file_name)
+            print(format_report(report))
+            write_report(report, os.path.splitext(file_name)[0] + '_profile.json')
+    return file_name
+
+def get_figure_file_name(run_id, data_type, x, y, generations, z_bins, output_dir=None):
+    """Returns the path `plot_figure` saves a figure to."""
+    file_name = '%s_%s_%s_%s_' % (run_id, x, y, data_type) + \
+        'bins%sto%s_' % (z_bins[0], z_bins[-1]) + \
+        'gens%sto%s.png' % (generations[0], generations[-1])
+    if output_dir != None:
+        file_name = os.path.join(output_dir, file_name)
+    return file_name
@@ -1,18 +1,39 @@
 # standard imports
+import functools
 import os
 
 # related third party imports
 import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 # local application/library specific imports
 import data_vu
 
+@functools.lru_cache(maxsize=None)
 def load_config_file(run_id):
     """Reads input file.
     Input files must be in .yaml format, see htsohm.sample.yaml
+
+    The file is parsed once per run_id (with libyaml's C loader, if available)
+    and the same dict is returned on later calls; don't modify it.
     """
     DV_path = os.path.dirname(data_vu.__file__)
     config_path = os.path.join(DV_path, 'config', run_id + '.yaml')
     with open(config_path) as file:
-        config = yaml.load(file)
+        config = yaml.load(file, Loader=SafeLoader)
     return config
+
+def write_config_file(run_id, config):
+    """Writes a run's config to where `load_config_file` reads it from, and
+    drops any cached copy.
+    """
+    DV_path = os.path.dirname(data_vu.__file__)
+    config_dir = os.path.join(DV_path, 'config')
+    if not os.path.exists(config_dir):
+        os.makedirs(config_dir)
+    with open(os.path.join(config_dir, run_id + '.yaml'), 'w') as file:
+        yaml.safe_dump(config, file, default_flow_style=False)
+    load_config_file.cache_clear()
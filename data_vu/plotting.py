@@ -1,8 +1,5 @@
 import os
 
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-import matplotlib.patches as patches
 import numpy as np
 
 from data_vu.utilities import *
@@ -15,7 +12,10 @@ def plot_points(
         config, ax, z_bins, generations,
         labels = None,
         highlight_children='on',
-        highlight_parents='off'
+        highlight_parents='off',
+        run_data = None,
+        point_style = 'scatter',
+        context = None
     ):
     """Create scatterplot 'x' v. 'y' either by plotting a z-axis slice,
         or all slices at once.
@@ -31,11 +31,23 @@ def plot_points(
         labels (str): None(default), `first_only`, `all`
         highlight_children (str): `on`(default), `off`
         highlight_parents (str): `on`, `off`(default)
+        run_data (RunData): optional, in-memory run arrays used instead of
+            querying the database.
+        point_style (str): `scatter`(default), `rasterized` (scatter drawn as
+            an image when saved), `density` (previous generations drawn as a
+            2D-histogram, for very large runs).
+        context (RunContext): optional, supplies config, run_data and summary
+            (overriding those arguments), loaded once per run.
 
     Returns:
         None
 
     """
+    import matplotlib.pyplot as plt
+
+    if context != None:
+        config = context.config
+        run_data = context.run_data
     x_limits = get_limits(x, config)
     y_limits = get_limits(y, config)
     plt.xlim(x_limits)
@@ -72,40 +84,87 @@ def plot_points(
     elif highlight_children == 'on':
         child_colour = 'r'
 
-    for i in range(gen):
-        values = query_points(x, y, z_bin, run_id, i)
-        for i in values:
-            plt.scatter(
-                i[0], i[1],
-                marker='o', 
-                facecolors='k',
-                edgecolors='none',
-                alpha=0.2, s=2
-            )
+    rasterized = point_style in ['rasterized', 'density']
 
-    values = query_points(x, y, z_bin, run_id, gen)
-    for i in values:
-        plt.scatter(
-            i[0], i[1],
+    values = np.asarray(
+        query_previous_points(x, y, z_bin, run_id, gen, run_data), dtype=float
+    ).reshape(-1, 2)
+    if point_style == 'density':
+        plot_density(values, x_limits, y_limits, ax)
+    elif len(values) > 0:
+        ax.scatter(
+            values[:, 0], values[:, 1],
+            marker='o',
+            facecolors='k',
+            edgecolors='none',
+            alpha=0.2, s=2,
+            rasterized=rasterized
+        )
+
+    values = np.asarray(
+        query_points(x, y, z_bin, run_id, gen, run_data), dtype=float
+    ).reshape(-1, 2)
+    if len(values) > 0:
+        ax.scatter(
+            values[:, 0], values[:, 1],
             marker='o',
             facecolors=child_colour,
             edgecolors='none',
-            alpha=0.6, s=2
+            alpha=0.6, s=2,
+            rasterized=rasterized
         )
 
     if highlight_parents == 'on':
         if gen != 0:
-            values = query_parents(x, y, z_bin, run_id, gen)
-            for i in values:
-                plt.scatter(
-                    i[0][0], i[0][1],
+            values = np.asarray(
+                query_parents(x, y, z_bin, run_id, gen, run_data), dtype=float
+            ).reshape(-1, 2)
+            if len(values) > 0:
+                ax.scatter(
+                    values[:, 0], values[:, 1],
                     marker='o',
                     facecolors='none',
                     edgecolors='y',
-                    linewidth='0.2',
-                    alpha=0.6, s=4
+                    linewidth=0.2,
+                    alpha=0.6, s=4,
+                    rasterized=rasterized
                 )
 
+def plot_density(values, x_limits, y_limits, ax, bins=256):
+    """Draw points as one greyscale 2D-histogram image, for runs too large to
+        scatter point-by-point.
+
+    Args:
+        values (numpy.ndarray): [x(float), y(float)] rows.
+        x_limits (list): [x_min, x_max]
+        y_limits (list): [y_min, y_max]
+        ax : plt.subplot(111)
+        bins (int): histogram bins along each axis.
+
+    Returns:
+        None
+
+    """
+    import matplotlib.cm as cm
+
+    counts, _, _ = np.histogram2d(
+        values[:, 0], values[:, 1],
+        bins = bins,
+        range = [x_limits, y_limits]
+    )
+    counts = np.ma.masked_equal(counts.T, 0)
+    ax.imshow(
+        np.log1p(counts),
+        origin = 'lower',
+        extent = [x_limits[0], x_limits[1], y_limits[0], y_limits[1]],
+        aspect = 'auto',
+        interpolation = 'nearest',
+        cmap = cm.Greys,
+        vmin = 0,
+        alpha = 0.6,
+        zorder = 0
+    )
+
 def add_square(
         x, y, 
         x_value, y_value,
@@ -114,6 +173,8 @@ def add_square(
         ax, config,
         linewidth=None,
         linestyle='solid'):
+    import matplotlib.patches as patches
+
     x_width = get_width(x, config)
     y_width = get_width(y, config)
     x_pos = x_value * x_width
@@ -131,13 +192,105 @@ def add_square(
         )
     )
 
+def plot_bin_grid(values, x, y, ax, config, scale=1.):
+    """Draw bins as one mesh: each [x_bin, y_bin, value] row fills its bin with
+        `cm.Reds(value / scale)`; bins without a row are left empty.
+
+    Args:
+        values (list, numpy.ndarray): [x_bin, y_bin, value] rows.
+        x (str): `ml_bin`, `sa_bin`, `vf_bin`, etc., for the bin width.
+        y (str): `ml_bin`, `sa_bin`, `vf_bin`, etc., for the bin width.
+        ax : plt.subplot(111)
+        config (yaml.load): use `data_vu.files.load_config_file`
+        scale (float): values are divided by this (the max bin-count, for
+            bin-counts).
+
+    Returns:
+        mesh (matplotlib.collections.QuadMesh): None if there are no rows.
+
+    """
+    import matplotlib.cm as cm
+
+    values = np.asarray(values, dtype=float).reshape(-1, 3)
+    values = values[~np.isnan(values[:, :2]).any(axis=1)]
+    if len(values) == 0:
+        return None
+    bins = values[:, :2].astype(int)
+    low = np.minimum(bins.min(axis=0), 0)
+    high = np.maximum(bins.max(axis=0) + 1, config['number_of_convergence_bins'])
+    return ax.pcolormesh(
+        np.arange(low[0], high[0] + 1) * get_width(x, config),
+        np.arange(low[1], high[1] + 1) * get_width(y, config),
+        np.ma.masked_invalid(bin_grid(values, low, high, scale).T),
+        cmap = cm.Reds,
+        vmin = 0,
+        vmax = 1,
+        shading = 'flat'
+    )
+
+def bin_grid(values, low, high, scale=1.):
+    """Scatters [x_bin, y_bin, value] rows into a dense array indexed
+    [x_bin - low[0], y_bin - low[1]]; NaN where there's no row. Rows outside
+    low..high are dropped.
+    """
+    values = np.asarray(values, dtype=float).reshape(-1, 3)
+    values = values[~np.isnan(values[:, :2]).any(axis=1)]
+    bins = values[:, :2].astype(int)
+    inside = ((bins >= low) & (bins < high)).all(axis=1)
+    grid = np.full(np.subtract(high, low), np.nan)
+    grid[bins[inside, 0] - low[0], bins[inside, 1] - low[1]] = values[inside, 2] / scale
+    return grid
+
+def plot_bin_outlines(bins, x, y, ax, config, edgecolor, linewidth=None, linestyle='solid'):
+    """Outline bins, all in one collection.
+
+    Args:
+        bins (list, numpy.ndarray): [x_bin, y_bin] rows; repeats are drawn once.
+        x (str): `ml_bin`, `sa_bin`, `vf_bin`, etc., for the bin width.
+        y (str): `ml_bin`, `sa_bin`, `vf_bin`, etc., for the bin width.
+        ax : plt.subplot(111)
+        config (yaml.load): use `data_vu.files.load_config_file`
+        edgecolor : matplotlib colour.
+        linewidth (float): None(default), matplotlib's default.
+        linestyle (str): `solid`(default), `:`, etc.
+
+    Returns:
+        outlines (matplotlib.collections.PolyCollection): update with
+            `outlines.set_verts(bin_outline_vertices(...))`.
+
+    """
+    from matplotlib.collections import PolyCollection
+
+    return ax.add_collection(
+        PolyCollection(
+            bin_outline_vertices(bins, x, y, config),
+            facecolors = 'none',
+            edgecolors = edgecolor,
+            linewidths = linewidth,
+            linestyles = linestyle
+        ),
+        autolim = False
+    )
+
+def bin_outline_vertices(bins, x, y, config):
+    """Returns the corners of each distinct [x_bin, y_bin] row's square, as
+    an array indexed [bin, corner, (x, y)].
+    """
+    bins = np.asarray(bins, dtype=float).reshape(-1, 2)
+    bins = np.unique(bins[~np.isnan(bins).any(axis=1)], axis=0)
+    corners = np.array([[0, 0], [1, 0], [1, 1], [0, 1]])
+    return (bins[:, np.newaxis, :] + corners) * [get_width(x, config), get_width(y, config)]
+
 def plot_bin_counts(
         x, y, z_bin,
         run_id, gen,
         config, ax, z_bins, generations,
         labels = None,
         highlight_children='off',
-        highlight_parents='off'
+        highlight_parents='off',
+        run_data = None,
+        summary = None,
+        context = None
     ):
     """Create bin-plot 'x' v. 'y' either by plotting a z-axis slice,
         or all slices at once. Bins are coloured by bin-count.
@@ -153,11 +306,23 @@ def plot_bin_counts(
         labels (str): None(default), `first_only`, `all`
         highlight_children (str): `on`(default), `off`
         highlight_parents (str): `on`, `off`(default)
+        run_data (RunData): optional, in-memory run arrays used instead of
+            querying the database.
+        summary (RunSummary): optional, read bin-counts from
+            `material_summaries` instead of raw materials.
+        context (RunContext): optional, supplies config, run_data and summary
+            (overriding those arguments), loaded once per run.
 
     Returns:
         None
 
     """
+    import matplotlib.pyplot as plt
+
+    if context != None:
+        config = context.config
+        run_data = context.run_data
+        summary = context.summary
     x_limits = get_limits(x, config)
     y_limits = get_limits(y, config)
     plt.xlim(x_limits)
@@ -189,42 +354,18 @@ def plot_bin_counts(
         plt.xlabel(x)
         plt.ylabel(y)
 
-    max_count = get_max_count(run_id)
-    values = query_bin_counts(x, y, z_bin, run_id, gen)
-    for i in values:
-        color = cm.Reds( float(i[2]) / float(max_count) )
-        add_square(
-            x, y,
-            i[0], i[1],
-            color,
-            None,
-            ax, config
-        )
+    max_count = get_max_count(run_id, run_data, summary)
+    values = query_bin_counts(x, y, z_bin, run_id, gen, run_data, summary)
+    plot_bin_grid(values, x, y, ax, config, float(max_count))
 
     if highlight_parents == 'on':
         if gen != 0:
-            values = query_parents(x, y, z_bin, run_id, gen)
-            for i in values:
-                add_square(
-                    x, y,
-                    i[0][0], i[0][1],
-                    'none',
-                    'y',
-                    ax, config,
-                    2
-                )
+            values = query_parents(x, y, z_bin, run_id, gen, run_data)
+            plot_bin_outlines(values, x, y, ax, config, 'y', 2)
 
     if highlight_children == 'on':
-        values = query_child_bins(x, y, z_bin, run_id, gen)
-        for i in values:
-            add_square(
-                x, y,
-                i[0], i[1],
-                'none',
-                'r',
-                ax, config,
-                1, ':'
-            )
+        values = query_child_bins(x, y, z_bin, run_id, gen, run_data, summary)
+        plot_bin_outlines(values, x, y, ax, config, 'r', 1, ':')
 
 def plot_mutation_strengths(
         x, y, z_bin,
@@ -232,7 +373,10 @@ def plot_mutation_strengths(
         config, ax, z_bins, generations,
         labels = None,
         highlight_children='off',
-        highlight_parents='off'
+        highlight_parents='off',
+        run_data = None,
+        summary = None,
+        context = None
     ):
     """Create bin-plot 'x' v. 'y' either by plotting a z-axis slice,
         or all slices at once. Bins are coloured by mutation strength.
@@ -248,11 +392,23 @@ def plot_mutation_strengths(
         labels (str): None(default), `first_only`, `all`
         highlight_children (str): `on`(default), `off`
         highlight_parents (str): `on`, `off`(default)
+        run_data (RunData): optional, in-memory run arrays used instead of
+            querying the database.
+        summary (RunSummary): optional, read bin-counts from
+            `material_summaries` instead of raw materials.
+        context (RunContext): optional, supplies config, run_data and summary
+            (overriding those arguments), loaded once per run.
 
     Returns:
         None
 
     """
+    import matplotlib.pyplot as plt
+
+    if context != None:
+        config = context.config
+        run_data = context.run_data
+        summary = context.summary
     x_limits = get_limits(x, config)
     y_limits = get_limits(y, config)
     plt.xlim(x_limits)
@@ -284,38 +440,14 @@ def plot_mutation_strengths(
         plt.xlabel(x)
         plt.ylabel(y)
  
-    values = query_mutation_strength(x, y, z_bin, run_id, gen)
-    for i in values:
-        color = cm.Reds( i[2] )
-        add_square(
-            x, y,
-            i[0], i[1],
-            color,
-            None,
-            ax, config
-        )
+    values = query_mutation_strength(x, y, z_bin, run_id, gen, run_data, context)
+    plot_bin_grid(values, x, y, ax, config)
 
     if highlight_parents == 'on':
         if gen != 0:
-            values = query_parents(x, y, z_bin, run_id, gen)
-            for i in values:
-                add_square(
-                    x, y,
-                    i[0][0], i[0][1],
-                    'none',
-                    'y',
-                    ax, config,
-                    2
-                )
+            values = query_parents(x, y, z_bin, run_id, gen, run_data)
+            plot_bin_outlines(values, x, y, ax, config, 'y', 2)
 
     if highlight_children == 'on':
-        values = query_child_bins(x, y, z_bin, run_id, gen)
-        for i in values:
-            add_square(
-                x, y,
-                i[0], i[1],
-                'none',
-                'r',
-                ax, config,
-                1, ':'
-            )
+        values = query_child_bins(x, y, z_bin, run_id, gen, run_data, summary)
+        plot_bin_outlines(values, x, y, ax, config, 'r', 1, ':')
@@ -0,0 +1,209 @@
+"""Opt-in timing of figure rendering: SQL round trips, query functions,
+drawing and saving.
+
+Turn it on with `DATA_VU_PROFILE=1`, or `profile=True` on `plot_figure` /
+`plot_HTSOHM` (`render --profile`). When it's off nothing is listening on the
+engine and the only cost is one global lookup per query function call.
+
+"""
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_profiler = None
+
+def profile_enabled(profile=None):
+    """`profile` if it is given, otherwise the `DATA_VU_PROFILE` env var."""
+    if profile != None:
+        return bool(profile)
+    return os.environ.get('DATA_VU_PROFILE', '') not in ('', '0')
+
+class Profiler(object):
+    """Collects timings for one figure.
+
+    `queries` holds (count, seconds) of SQL statements per calling function
+    in data_vu. Each entry in `panels` splits one panel's wall time into
+    `query` (inside a `data_vu.queries` function; of which `database` is
+    executing SQL and `rows` is the rest, mostly turning rows into Python
+    objects) and `draw` (everything else: matplotlib artists). Statements
+    run on other threads (e.g. by a `data_vu.async_queries.Prefetcher`) are
+    counted in `queries` but not in panels.
+
+    """
+
+    def __init__(self):
+        self.queries = {}
+        self.panels = []
+        self.phases = {}
+        self.panel = None
+        self.query_depth = 0
+        self.started = time.perf_counter()
+        self.thread = threading.current_thread()
+
+    def start(self):
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def stop(self):
+        event.remove(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('data_vu_statement_starts', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('data_vu_statement_starts')
+        if not starts:
+            return
+        seconds = time.perf_counter() - starts.pop()
+        caller = get_caller()
+        count, total = self.queries.get(caller, (0, 0.))
+        self.queries[caller] = (count + 1, total + seconds)
+        if self.panel != None and threading.current_thread() is self.thread:
+            self.panel['queries'] += 1
+            self.panel['database'] += seconds
+
+    @contextlib.contextmanager
+    def time_panel(self, generation, z_bin):
+        self.panel = {
+            'generation' : generation,
+            'z_bin' : z_bin,
+            'queries' : 0,
+            'query' : 0.,
+            'database' : 0.
+        }
+        start = time.perf_counter()
+        try:
+            yield self.panel
+        finally:
+            panel = self.panel
+            self.panel = None
+            panel['total'] = time.perf_counter() - start
+            panel['rows'] = max(panel['query'] - panel['database'], 0.)
+            panel['draw'] = panel['total'] - panel['query']
+            self.panels.append(panel)
+
+    @contextlib.contextmanager
+    def time_phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - start
+
+    def report(self, figure=None):
+        """Returns every timing as a JSON-serializable dict."""
+        totals = {}
+        for key in ['total', 'query', 'database', 'rows', 'draw', 'queries']:
+            totals[key] = sum(panel[key] for panel in self.panels)
+        return {
+            'figure' : figure,
+            'total' : time.perf_counter() - self.started,
+            'phases' : dict(self.phases),
+            'panels' : self.panels,
+            'panel_totals' : totals,
+            'queries' : dict(
+                (caller, {'count' : count, 'seconds' : seconds})
+                for caller, (count, seconds) in self.queries.items()
+            )
+        }
+
+# helpers that run SQL on behalf of their caller; statements are credited to
+# the function that called them
+HELPER_FRAMES = {
+    'utilities.stream_array'
+}
+
+def get_caller():
+    """Names the innermost data_vu function on the stack, e.g.
+    `queries.query_points`; SQLAlchemy, this module and `HELPER_FRAMES` are
+    skipped.
+    """
+    frame = sys._getframe(1)
+    while frame != None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('data_vu.') and module != __name__:
+            caller = '%s.%s' % (module[len('data_vu.'):], frame.f_code.co_name)
+            if caller not in HELPER_FRAMES:
+                return caller
+        frame = frame.f_back
+    return '(other)'
+
+@contextlib.contextmanager
+def profiling(profile=None):
+    """Profiles the enclosed block if enabled; yields the Profiler or None."""
+    global _profiler
+    if not profile_enabled(profile) or _profiler != None:
+        yield None
+        return
+    _profiler = Profiler()
+    _profiler.start()
+    try:
+        yield _profiler
+    finally:
+        _profiler.stop()
+        _profiler = None
+
+def time_panel(generation, z_bin):
+    if _profiler == None:
+        return contextlib.nullcontext()
+    return _profiler.time_panel(generation, z_bin)
+
+def time_phase(name):
+    if _profiler == None:
+        return contextlib.nullcontext()
+    return _profiler.time_phase(name)
+
+def timed_query(function):
+    """Decorator: while profiling, adds the call's wall time to the current
+    panel's `query` time (calls nested in another query count once).
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler
+        if profiler == None or profiler.panel == None or profiler.query_depth > 0:
+            return function(*args, **kwargs)
+        profiler.query_depth += 1
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.query_depth -= 1
+            if profiler.panel != None:
+                profiler.panel['query'] += time.perf_counter() - start
+    return wrapper
+
+def format_report(report):
+    """Formats a `Profiler.report` as a plain-text table."""
+    lines = []
+    if report['figure'] != None:
+        lines.append(report['figure'])
+    lines.append('%-18s%9s%9s%9s%9s%9s%9s' % (
+        'panel', 'total', 'query', 'database', 'rows', 'draw', 'queries'
+    ))
+    panels = [('gen %s bin %s' % (panel['generation'], panel['z_bin']), panel)
+              for panel in report['panels']]
+    for label, panel in panels + [('all panels', report['panel_totals'])]:
+        lines.append('%-18s%9.3f%9.3f%9.3f%9.3f%9.3f%9d' % (
+            label, panel['total'], panel['query'], panel['database'],
+            panel['rows'], panel['draw'], panel['queries']
+        ))
+    for name, seconds in sorted(report['phases'].items()):
+        lines.append('%-18s%9.3f' % (name, seconds))
+    lines.append('%-18s%9.3f' % ('figure', report['total']))
+    lines.append('')
+    lines.append('%-50s%9s%9s' % ('SQL by caller', 'count', 'seconds'))
+    for caller, query in sorted(report['queries'].items(), key=lambda item: -item[1]['seconds']):
+        lines.append('%-50s%9d%9.3f' % (caller, query['count'], query['seconds']))
+    return '\n'.join(lines)
+
+def write_report(report, file_name):
+    with open(file_name, 'w') as file:
+        json.dump(report, file, indent=2)
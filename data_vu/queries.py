@@ -1,28 +1,60 @@
+import functools
+
+import numpy as np
 from sqlalchemy import func
+from sqlalchemy.orm import Query, aliased
 
 from data_vu.utilities import *
-from data_vu.db.__init__ import session
+from data_vu.db import session
 from data_vu.db.material import Material
 from data_vu.db.mutation_strength import MutationStrength
 from data_vu.files import load_config_file
-
-def count_generations(run_id):
+from data_vu.profiling import timed_query
+
+# The database path of each panel query is built as an unbound `Query` by the
+# `*_query` function next to it; the functions here run it on the thread's
+# session, `data_vu.async_queries` runs `query.statement` on an async
+# connection. A `data_vu.async_queries.Prefetcher`, while one is active, hands
+# back results it fetched ahead of time.
+_prefetcher = None
+
+def prefetched(function):
+    """Decorator: return the active prefetcher's result for this call, if it
+    has one; otherwise query as usual.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        prefetcher = _prefetcher
+        if prefetcher != None:
+            found, value = prefetcher.take(function.__name__, args, kwargs)
+            if found:
+                return value
+        return function(*args, **kwargs)
+    return wrapper
+
+@timed_query
+def count_generations(run_id, run_data=None):
     """Queries database for last generation in run.
 
     Args:
         run_id (str): run identification string.
+        run_data (RunData): optional, answer from in-memory run arrays.
 
     Returns:
         generations (int): number of generations in run.
 
     """
+    if run_data != None:
+        return run_data.count_generations()
     generations = session \
         .query(func.max(Material.generation)) \
         .filter(Material.run_id == run_id) \
         .all()[0][0]
     return generations
 
-def query_points(x, y, z_bin, run_id, gen):
+@timed_query
+@prefetched
+def query_points(x, y, z_bin, run_id, gen, run_data=None, chunk_size=10000):
     """Queries database for two structure-properties.
 
     Args:
@@ -31,36 +63,77 @@ def query_points(x, y, z_bin, run_id, gen):
         z_bin (int): None, [0, number_of_bins].
         run_id (str): run identification string.
         gen (int): generation.
+        run_data (RunData): optional, answer from in-memory run arrays.
+        chunk_size (int): rows fetched per round trip; rows are streamed
+            into one float array, see `data_vu.utilities.stream_array`.
 
     Returns:
-        values (list): [x(float), y(float)]
+        values (numpy.ndarray): [x(float), y(float)]
 
     If z_bin == None: all z_bins are queried, instead of one slice.
 
     """
+    if run_data != None:
+        return run_data.points(x, y, z_bin, gen)
+    query = points_query(x, y, z_bin, run_id, gen).with_session(session())
+    values = stream_array(query, 2, chunk_size)
+    return values
+
+def points_query(x, y, z_bin, run_id, gen):
+    """Builds the database query of `query_points`."""
     x_attr = get_attr(x)
     y_attr = get_attr(y)
-    if z_bin == None:
-        values = session \
-            .query(x_attr, y_attr) \
-            .filter(
-                Material.run_id == run_id,
-                Material.generation == gen
-            ) \
-            .all()
+    filters = [
+        Material.run_id == run_id,
+        Material.generation == gen
+    ]
     if z_bin != None:
-        z_attr = get_z_attr(x, y)
-        values = session \
-            .query(x_attr, y_attr) \
-            .filter(
-                Material.run_id == run_id,
-                Material.generation == gen,
-                z_attr == z_bin
-            ) \
-            .all()
+        filters.append(get_z_attr(x, y) == z_bin)
+    return Query([x_attr, y_attr]).filter(*filters)
+
+@timed_query
+@prefetched
+def query_previous_points(x, y, z_bin, run_id, gen, run_data=None, chunk_size=10000):
+    """Queries database for two structure-properties of every material from
+    generations before `gen`, in one query.
+
+    Args:
+        x (str): `ml`, `sa`, `vf`.
+        y (str): `ml`, `sa`, `vf`.
+        z_bin (int): None, [0, number_of_bins].
+        run_id (str): run identification string.
+        gen (int): generation.
+        run_data (RunData): optional, answer from in-memory run arrays.
+        chunk_size (int): rows fetched per round trip; rows are streamed
+            into one float array, see `data_vu.utilities.stream_array`.
+
+    Returns:
+        values (numpy.ndarray): [x(float), y(float)]
+
+    If z_bin == None: all z_bins are queried, instead of one slice.
+
+    """
+    if run_data != None:
+        return run_data.previous_points(x, y, z_bin, gen)
+    query = previous_points_query(x, y, z_bin, run_id, gen).with_session(session())
+    values = stream_array(query, 2, chunk_size)
     return values
 
-def query_bin_counts(x, y, z_bin, run_id, gen):
+def previous_points_query(x, y, z_bin, run_id, gen):
+    """Builds the database query of `query_previous_points`."""
+    x_attr = get_attr(x)
+    y_attr = get_attr(y)
+    filters = [
+        Material.run_id == run_id,
+        Material.generation < gen
+    ]
+    if z_bin != None:
+        filters.append(get_z_attr(x, y) == z_bin)
+    return Query([x_attr, y_attr]).filter(*filters)
+
+@timed_query
+@prefetched
+def query_bin_counts(x, y, z_bin, run_id, gen, run_data=None, summary=None):
     """Queries database for bin_counts.
 
     Args:
@@ -69,6 +142,8 @@ def query_bin_counts(x, y, z_bin, run_id, gen):
         z_bin (int): None, [0, number_of_bins].
         run_id (str): run identification string.
         gen (int): generation.
+        run_data (RunData): optional, answer from in-memory run arrays.
+        summary (RunSummary): optional, answer from `material_summaries`.
 
     Returns:
         values (list): [x_bin, y_bin, bin_count]
@@ -76,85 +151,68 @@ def query_bin_counts(x, y, z_bin, run_id, gen):
     If z_bin == None: all z_bins are queried, instead of one slice.
 
     """
+    if run_data != None:
+        return run_data.bin_counts(x, y, z_bin, gen)
+    if summary != None:
+        return summary.bin_counts(x, y, z_bin, gen)
+    values = bin_counts_query(x, y, z_bin, run_id, gen).with_session(session()).all()
+    return values
+
+def bin_counts_query(x, y, z_bin, run_id, gen):
+    """Builds the database query of `query_bin_counts`."""
     x_attr = get_attr(x)
     y_attr = get_attr(y)
-    z_attr = get_z_attr(x, y)
-    if z_bin == None:
-        values = session \
-            .query(
-                x_attr,
-                y_attr,
-                func.count(Material.uuid)
-            ) \
-            .filter(
-                Material.run_id == run_id,
-                Material.generation <= gen
-            ) \
-            .group_by(
-                x_attr,
-                y_attr
-            ) \
-            .all()
+    filters = [
+        Material.run_id == run_id,
+        Material.generation <= gen
+    ]
     if z_bin != None:
-        values = session \
-            .query(
-                x_attr,
-                y_attr,
-                func.count(Material.uuid)
-            ) \
-            .filter(
-                Material.run_id == run_id,
-                Material.generation <= gen,
-                z_attr == z_bin
-            ) \
-            .group_by(
-                x_attr,
-                y_attr
-            ) \
-            .all()
-    return values
+        filters.append(get_z_attr(x, y) == z_bin)
+    return Query([x_attr, y_attr, func.count(Material.uuid)]) \
+        .filter(*filters) \
+        .group_by(
+            x_attr,
+            y_attr
+        )
 
-def get_max_count(run_id):
+@timed_query
+@prefetched
+def get_max_count(run_id, run_data=None, summary=None):
     """Query database for highest bin-count.
 
     Args:
         run_id (str): run identification string.
+        run_data (RunData): optional, answer from in-memory run arrays.
+        summary (RunSummary): optional, answer from `material_summaries`.
 
     Returns:
         max_counts (int): highest bin-count.
 
     """
-    counts = session \
-        .query(func.count(Material.uuid)) \
+    if run_data != None:
+        return run_data.max_count()
+    if summary != None:
+        return summary.max_count()
+    counts = max_count_query(run_id).with_session(session()).all()
+    max_counts = max(counts)[0]
+
+    return max_counts
+
+def max_count_query(run_id):
+    """Builds the database query of `get_max_count` (bin-counts; the
+    caller takes the max).
+    """
+    return Query([func.count(Material.uuid)]) \
         .filter(Material.run_id == run_id) \
         .group_by(
                 Material.methane_loading_bin,
                 Material.surface_area_bin,
                 Material.void_fraction_bin
-        ).all()
-    max_counts = max(counts)[0]
+        )
 
-    return max_counts
-
-def get_bin_coordinate(x_attr, y_attr, x, y, z):
-    if x_attr == getattr(MutationStrength, 'methane_loading_bin'):
-        if y_attr == getattr(MutationStrength, 'surface_area_bin'):
-            coords = [x, y, z]
-        elif y_attr == getattr(MutationStrength, 'void_fraction_bin'):
-            coords = [x, z, y]
-    elif x_attr == getattr(MutationStrength, 'surface_area_bin'):
-        if y_attr == getattr(MutationStrength, 'methane_loading_bin'):
-            coords = [y, x, z]
-        elif y_attr == getattr(MutationStrength, 'void_fraction_bin'):
-            coords = [z, x, y]
-    elif x_attr == getattr(MutationStrength, 'void_fraction_bin'):
-        if y_attr == getattr(MutationStrength, 'methane_loading_bin'):
-            coords = [y, z, x]
-        elif y_attr == getattr(MutationStrength, 'surface_area_bin'):
-            coords = [z, y, x]
-    return coords
-
-def query_mutation_strength(x, y, z_bin, run_id, gen):
+@timed_query
+@prefetched
+def query_mutation_strength(x, y, z_bin, run_id, gen, run_data=None, context=None):
     """Queries database for mutation strengths.
 
     Args:
@@ -163,69 +221,69 @@ def query_mutation_strength(x, y, z_bin, run_id, gen):
         z_bin (int): None, [0, number_of_bins].
         run_id (str): run identification string.
         gen (int): generation.
+        run_data (RunData): optional, answer from the run's mutation strength
+            history.
+        context (RunContext): optional, supplies the run's config (and
+            run_data, if not passed) instead of loading it.
 
     Returns:
-        values (list): [x_bin, y_bin, mutation_strength]
+        values (numpy.ndarray): [x_bin, y_bin, mutation_strength]
 
-    If z_bin == None: all z_bins are queried, instead of one slice.
+    If z_bin == None: strengths are averaged along the z-axis, instead of
+    taking one slice. Bins without a strength (no row, and no
+    `initial_mutation_strength` configured) are skipped.
 
     """
-    number_of_bins = load_config_file(run_id)['number_of_convergence_bins']
-    x_attr = get_attr(x)
-    y_attr = get_attr(y)
-
-    values = []
+    if context != None:
+        number_of_bins = context.number_of_bins
+        initial_strength = context.initial_strength
+        if run_data == None:
+            run_data = context.run_data
+    else:
+        config = load_config_file(run_id)
+        number_of_bins = config['number_of_convergence_bins']
+        initial_strength = config.get('initial_mutation_strength', np.nan)
+    if run_data != None:
+        strengths = run_data \
+            .get_strength_history(number_of_bins, initial_strength) \
+            .strength_at(gen)
+    else:
+        strengths = MutationStrength.get_prior_grid(
+            run_id, gen, number_of_bins, initial_strength
+        )
+    return strength_values(orient_bins(strengths, x, y), z_bin)
+
+def strength_values(strengths, z_bin):
+    """Reduces an [x_bin, y_bin, z_bin] mutation strength array to
+    [x_bin, y_bin, mutation_strength] rows, averaging along z if z_bin == None.
 
+    """
     if z_bin == None:
-        for x in range(number_of_bins):
-            for y in range(number_of_bins):
-                all_strengths = []
-                for z in range(number_of_bins):
-                    coords = get_bin_coordinate(x_attr, y_attr, x, y, z)
-                    key = [run_id, gen] + coords
-                    try:
-                        strength = MutationStrength.get_prior(*key)
-                        if type(strength) == int or type(strength) == float:
-                            all_strengths.append(strength)
-                    except KeyError as e:
-                        if e.args[0] != 'initial_mutation_strength':
-                            raise
-                        else:
-                            pass
-                average_strength = sum(all_strengths) / float(len(all_strengths))
-                value = [x, y, average_strength]
-                values.append(value)
-
-    if z_bin != None:
-        for x in range(number_of_bins):
-            for y in range(number_of_bins):
-                coords = get_bin_coordinate(x_attr, y_attr, x, y, z_bin)
-                key = [run_id, gen] + coords
-                try:
-                    strength = MutationStrength.get_prior(*key)
-                    if type(strength) == int or type(strength) == float:
-                        value = [x, y, strength]
-                        values.append(value)
-                except KeyError as e:
-                    if e.args[0] != 'initial_mutation_strength':
-                        raise
-                    else:
-                        pass
-            
-    return values
-
-def query_material(x, y, id):
+        defined = ~np.isnan(strengths)
+        totals = np.where(defined, strengths, 0.).sum(axis=2)
+        counts = defined.sum(axis=2)
+        plane = np.where(counts > 0, totals / np.maximum(counts, 1), np.nan)
+    else:
+        plane = strengths[:, :, z_bin]
+    xs, ys = np.nonzero(~np.isnan(plane))
+    return np.column_stack((xs, ys, plane[xs, ys]))
+
+@timed_query
+def query_material(x, y, id, run_data=None):
     """Query values `x` and `y` for one material.
 
     Args:
         x (str): `ml`, `sa`, `vf` or `ml_bin`, `sa_bin`, `vf_bin`
         y (str): `ml`, `sa`, `vf` or `ml_bin`, `sa_bin`, `vf_bin`
         id (int): Material.id
+        run_data (RunData): optional, answer from in-memory run arrays.
 
     Returns:
         value (list): [x(float, int), y(float, int)]
 
     """
+    if run_data != None:
+        return run_data.material(x, y, id)
     x_attr = get_attr(x)
     y_attr = get_attr(y)
     value = session \
@@ -234,7 +292,9 @@ def query_material(x, y, id):
         .all()
     return value
 
-def query_parents(x, y, z_bin, run_id, gen):
+@timed_query
+@prefetched
+def query_parents(x, y, z_bin, run_id, gen, run_data=None, chunk_size=10000):
     """Find parent-materials and return data.
     
     Args:
@@ -243,36 +303,42 @@ def query_parents(x, y, z_bin, run_id, gen):
         z_bin (int): None, [0, number_of_generations].
         run_id (str): run identification string.
         gen (int): generation.
+        run_data (RunData): optional, answer from in-memory run arrays.
+        chunk_size (int): rows fetched per round trip.
 
     Returns:
-        values (list): [x(float, int), y(float, int)]
+        values (numpy.ndarray): [x(float, int), y(float, int)], one row per
+            child; children without a parent (generation 0, NULL parent_id)
+            are skipped.
 
     """
-    if z_bin == None:
-        parents = session \
-            .query(Material.parent_id) \
-            .filter(
-                Material.run_id == run_id,
-                Material.generation == gen
-            ) \
-            .all()
-    if z_bin != None:
-        z_attr = get_z_attr(x, y)
-        parents = session \
-            .query(Material.parent_id) \
-            .filter(
-                Material.run_id == run_id,
-                Material.generation == gen,
-                z_attr == z_bin
-            ) \
-            .all()
-    values = []
-    for parent in parents:
-        value = query_material(x, y, parent)
-        values.append(value)
+    if run_data != None:
+        return run_data.parents(x, y, z_bin, gen)
+    query = parents_query(x, y, z_bin, run_id, gen).with_session(session())
+    values = stream_array(query, 2, chunk_size)
     return values
 
-def query_child_bins(x, y, z_bin, run_id, gen):
+def parents_query(x, y, z_bin, run_id, gen):
+    """Builds the database query of `query_parents`."""
+    child = aliased(Material)
+    parent = aliased(Material)
+    filters = [
+        child.run_id == run_id,
+        child.generation == gen
+    ]
+    if z_bin != None:
+        filters.append(getattr(child, get_z_attr(x, y).key) == z_bin)
+    return Query([
+            getattr(parent, get_attr(x).key),
+            getattr(parent, get_attr(y).key)
+        ]) \
+        .select_from(child) \
+        .join(parent, child.parent_id == parent.id) \
+        .filter(*filters)
+
+@timed_query
+@prefetched
+def query_child_bins(x, y, z_bin, run_id, gen, run_data=None, summary=None):
     """Query bin-coordinates for across generation.
     
     Args:
@@ -281,58 +347,62 @@ def query_child_bins(x, y, z_bin, run_id, gen):
         z_bin (int): None, [0, number_of_generations].
         run_id (str): run identification string.
         gen (int): generation.
+        run_data (RunData): optional, answer from in-memory run arrays.
+        summary (RunSummary): optional, answer from `material_summaries`.
 
     Returns:
         values (list): [x(float, int), y(float, int)]
 
     """
-    x_attr = get_attr(x)
-    y_attr = get_attr(y)
-    if z_bin == None:
-        values = session \
-            .query(
-                x_attr,
-                y_attr
-            ) \
-            .filter(
-                Material.run_id == run_id,
-                Material.generation == gen
-            ) \
-            .group_by(
-                x_attr,
-                y_attr
-            ) \
-            .all()
-    if z_bin != None:
-        z_attr = get_z_attr(x, y)
-        values = session \
-            .query(
-                x_attr,
-                y_attr
-            ) \
-            .filter(
-                Material.run_id == run_id,
-                Material.generation == gen,
-                z_attr == z_bin
-            ) \
-            .group_by(
-                x_attr,
-                y_attr
-            ) \
-            .all()
+    if run_data != None:
+        return run_data.child_bins(x, y, z_bin, gen)
+    if summary != None:
+        return summary.child_bins(x, y, z_bin, gen)
+    values = child_bins_query(x, y, z_bin, run_id, gen).with_session(session()).all()
     return values
 
-def evaluate_convergence(run_id, gen):
+def child_bins_query(x, y, z_bin, run_id, gen):
+    """Builds the database query of `query_child_bins`."""
+    # `*_mutation_strength` axes name MutationStrength columns; the bins are
+    # the material's own (as in `parents_query`)
+    x_attr = getattr(Material, get_attr(x).key)
+    y_attr = getattr(Material, get_attr(y).key)
+    filters = [
+        Material.run_id == run_id,
+        Material.generation == gen
+    ]
+    if z_bin != None:
+        filters.append(get_z_attr(x, y) == z_bin)
+    return Query([x_attr, y_attr]) \
+        .filter(*filters) \
+        .group_by(
+            x_attr,
+            y_attr
+        )
+
+@timed_query
+def evaluate_convergence(run_id, gen, run_data=None, summary=None):
     """Use variance to evaluate convergence.
 
     Args:
         run_id (str): run identification string.
         gen (int): generation.
+        run_data (RunData): optional, answer from in-memory run arrays.
+        summary (RunSummary): optional, answer from `material_summaries`.
 
     Returns:
         variance (float): variance.
 
     """
+    if run_data != None or summary != None:
+        if run_data != None:
+            bin_counts = run_data.all_bin_counts(gen)
+        else:
+            bin_counts = summary.all_bin_counts(gen)
+        variance = float(bin_counts.var())
+        print('\nvariance :\t%s\n' % variance)
+        return variance
+
     bin_counts = session \
         .query(
             func.count(Material.uuid)
@@ -356,3 +426,255 @@ def evaluate_convergence(run_id, gen):
     print('\nvariance :\t%s\n' % variance)
 
     return variance
+
+@timed_query
+def evaluate_convergence_curve(run_id, run_data=None):
+    """Evaluate convergence for every generation of a run at once.
+
+    Args:
+        run_id (str): run identification string.
+        run_data (RunData): optional, answer from in-memory run arrays.
+
+    Returns:
+        curve (dict): numpy arrays, one entry per generation:
+            `generation`,
+            `variance` (of bin-counts, over occupied bins; the same value as
+                `evaluate_convergence`),
+            `bins_filled` (number of occupied bins),
+            `entropy` (Shannon entropy of the bin-count distribution, nats).
+
+    Without run_data, bin-counts come from one GROUP BY over (generation,
+    bins); cumulative counts are then built with one cumulative sum.
+
+    """
+    if run_data != None:
+        counts = run_data.get_bin_count_tensor()
+    else:
+        number_of_bins = load_config_file(run_id)['number_of_convergence_bins']
+        rows = session \
+            .query(
+                Material.generation,
+                Material.methane_loading_bin,
+                Material.surface_area_bin,
+                Material.void_fraction_bin,
+                func.count(Material.id)
+            ) \
+            .filter(
+                Material.run_id == run_id,
+                Material.generation >= 0
+            ) \
+            .group_by(
+                Material.generation,
+                Material.methane_loading_bin,
+                Material.surface_area_bin,
+                Material.void_fraction_bin
+            ) \
+            .all()
+        rows = np.array(rows, dtype=float).reshape(-1, 5)
+        rows = rows[~np.isnan(rows).any(axis=1)].astype(int)
+        rows = rows[((rows[:, 1:4] >= 0) & (rows[:, 1:4] < number_of_bins)).all(axis=1)]
+        generations = rows[:, 0].max() + 1 if len(rows) > 0 else 1
+        counts = np.zeros((generations,) + (number_of_bins,) * 3, dtype=np.int64)
+        counts[rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3]] = rows[:, 4]
+        counts = counts.cumsum(axis=0)
+
+    counts = counts.reshape(len(counts), -1).astype(float)
+    bins_filled = (counts > 0).sum(axis=1)
+    totals = counts.sum(axis=1)
+    occupied = np.maximum(bins_filled, 1)
+    mean_counts = totals / occupied
+    variance = (counts ** 2).sum(axis=1) / occupied - mean_counts ** 2
+    probabilities = counts / np.maximum(totals, 1)[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entropy = -np.where(probabilities > 0, probabilities * np.log(probabilities), 0.).sum(axis=1)
+
+    return {
+        'generation' : np.arange(len(counts)),
+        'variance' : variance,
+        'bins_filled' : bins_filled,
+        'entropy' : entropy
+    }
+
+@timed_query
+def evaluate_child_retention(run_id, run_data=None):
+    """Evaluate, for every generation and parent bin of a run at once, how
+    many children stayed in their parent's bin and how far the rest moved.
+
+    Args:
+        run_id (str): run identification string.
+        run_data (RunData): optional, answer from in-memory run arrays.
+
+    Returns:
+        retention (dict): numpy arrays indexed [generation, ml_bin, sa_bin,
+                vf_bin] of the parents' bin:
+            `children` (children of parents in the bin),
+            `retained` (children in the same bin as their parent),
+            `fraction` (retained / children; NaN without children, where
+                `Material.calculate_percent_children_in_bin` would divide by
+                zero),
+            and the displacement distribution:
+            `transitions` ([generation, parent ml_bin, sa_bin, vf_bin,
+                child - parent ml_bin, sa_bin, vf_bin, count] rows, one per
+                distinct displacement; every child is counted once),
+            `distance` (children per generation, indexed [generation, d],
+                where d is the largest displacement along any axis; d = 0 is
+                retained).
+
+    Without run_data, transitions come from one GROUP BY over the child ->
+    parent join; the rest is built from them with numpy.
+
+    """
+    number_of_bins = load_config_file(run_id)['number_of_convergence_bins']
+    if run_data != None:
+        transitions = run_data.child_transitions()
+    else:
+        child = aliased(Material)
+        parent = aliased(Material)
+        child_bins = [child.methane_loading_bin, child.surface_area_bin, child.void_fraction_bin]
+        parent_bins = [parent.methane_loading_bin, parent.surface_area_bin, parent.void_fraction_bin]
+        displacements = [
+            (child_bin - parent_bin).label('d_%s' % i)
+            for i, (child_bin, parent_bin) in enumerate(zip(child_bins, parent_bins))
+        ]
+        rows = session \
+            .query(child.generation, *parent_bins, *displacements, func.count(child.id)) \
+            .select_from(child) \
+            .join(parent, child.parent_id == parent.id) \
+            .filter(
+                child.run_id == run_id,
+                child.generation >= 0
+            ) \
+            .group_by(child.generation, *(parent_bins + displacements)) \
+            .all()
+        transitions = np.array(rows, dtype=float).reshape(-1, 8)
+        transitions = transitions[~np.isnan(transitions).any(axis=1)].astype(np.int64)
+        transitions = transitions[np.lexsort(transitions[:, 6::-1].T)]
+
+    parent_bins = transitions[:, 1:4]
+    child_bins = parent_bins + transitions[:, 4:7]
+    in_range = ((parent_bins >= 0) & (parent_bins < number_of_bins) &
+                (child_bins >= 0) & (child_bins < number_of_bins)).all(axis=1)
+    transitions = transitions[in_range]
+
+    generations = transitions[:, 0].max() + 1 if len(transitions) > 0 else 1
+    shape = (generations,) + (number_of_bins,) * 3
+    cells = tuple(transitions[:, i] for i in range(4))
+    counts = transitions[:, 7]
+    children = np.zeros(shape, dtype=np.int64)
+    np.add.at(children, cells, counts)
+    retained = np.zeros(shape, dtype=np.int64)
+    stayed = (transitions[:, 4:7] == 0).all(axis=1)
+    np.add.at(retained, tuple(cell[stayed] for cell in cells), counts[stayed])
+    distance = np.zeros((generations, number_of_bins), dtype=np.int64)
+    np.add.at(distance, (transitions[:, 0], np.abs(transitions[:, 4:7]).max(axis=1)), counts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.where(children > 0, retained / children, np.nan)
+
+    return {
+        'generation' : np.arange(generations),
+        'children' : children,
+        'retained' : retained,
+        'fraction' : fraction,
+        'transitions' : transitions,
+        'distance' : distance
+    }
+
+@timed_query
+def evaluate_retests(run_id, tolerance, write=False, chunk_size=10000):
+    """Evaluate every retested material (`retest_num` > 0) of a run at once,
+    with the test of `Material.calculate_retest_result`.
+
+    Args:
+        run_id (str): run identification string.
+        tolerance (float): largest accepted difference between a retest mean
+            and the initially-calculated value, as a fraction of the latter.
+        write (bool): also store the results in `retest_passed`, with one
+            UPDATE (see `Material.retest_passed_clause`).
+        chunk_size (int): rows fetched per round trip.
+
+    Returns:
+        retests (dict): numpy arrays:
+            `id`, `passed`, `evaluated` (one entry per retested material),
+            `generation`, `generation_retested`, `generation_passed`,
+                `generation_pass_rate` (one entry per generation),
+            `bin_retested`, `bin_passed`, `bin_pass_rate` (indexed [ml_bin,
+                sa_bin, vf_bin]).
+            Pass rates are NaN where nothing was retested.
+            A retest with any NULL input (an initially-calculated value or a
+            retest sum) can't be evaluated: it is `passed` False, False in
+            `evaluated` (one entry per retested material), left out of the
+            retested and passed counts, and written as NULL.
+
+    """
+    number_of_bins = load_config_file(run_id)['number_of_convergence_bins']
+    query = session \
+        .query(
+            Material.id,
+            Material.generation,
+            Material.methane_loading_bin,
+            Material.surface_area_bin,
+            Material.void_fraction_bin,
+            Material.retest_num,
+            Material.ml_absolute_volumetric_loading,
+            Material.sa_volumetric_surface_area,
+            Material.vf_helium_void_fraction,
+            Material.retest_methane_loading_sum,
+            Material.retest_surface_area_sum,
+            Material.retest_void_fraction_sum
+        ) \
+        .filter(
+            Material.run_id == run_id,
+            Material.retest_num > 0
+        )
+    rows = stream_array(query, 12, chunk_size)
+    originals = rows[:, 6:9]
+    means = rows[:, 9:12] / rows[:, 5:6]
+    evaluated = ~np.isnan(rows[:, 5:12]).any(axis=1)
+    with np.errstate(invalid='ignore'):
+        failed = (np.abs(means - originals) >= tolerance * originals).any(axis=1)
+    passed = evaluated & ~failed
+
+    if write:
+        session \
+            .query(Material) \
+            .filter(
+                Material.run_id == run_id,
+                Material.retest_num > 0
+            ) \
+            .update(
+                {Material.retest_passed : Material.retest_passed_clause(tolerance)},
+                synchronize_session=False
+            )
+        session.commit()
+
+    generation = np.where(np.isnan(rows[:, 1]), -1, rows[:, 1]).astype(np.int64)
+    generations = generation.max() + 1 if (generation >= 0).any() else 0
+    has_generation = evaluated & (generation >= 0)
+    generation_retested = np.bincount(generation[has_generation], minlength=generations)
+    generation_passed = np.bincount(
+        generation[has_generation], weights=passed[has_generation], minlength=generations
+    ).astype(np.int64)
+
+    bins = np.where(np.isnan(rows[:, 2:5]), -1, rows[:, 2:5]).astype(np.int64)
+    in_range = evaluated & ((bins >= 0) & (bins < number_of_bins)).all(axis=1)
+    cells = tuple(bins[in_range].T)
+    bin_retested = np.zeros((number_of_bins,) * 3, dtype=np.int64)
+    np.add.at(bin_retested, cells, 1)
+    bin_passed = np.zeros((number_of_bins,) * 3, dtype=np.int64)
+    np.add.at(bin_passed, cells, passed[in_range].astype(np.int64))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'id' : rows[:, 0].astype(np.int64),
+            'passed' : passed,
+            'evaluated' : evaluated,
+            'generation' : np.arange(generations),
+            'generation_retested' : generation_retested,
+            'generation_passed' : generation_passed,
+            'generation_pass_rate' : np.where(
+                generation_retested > 0, generation_passed / generation_retested, np.nan
+            ),
+            'bin_retested' : bin_retested,
+            'bin_passed' : bin_passed,
+            'bin_pass_rate' : np.where(bin_retested > 0, bin_passed / bin_retested, np.nan)
+        }
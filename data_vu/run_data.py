@@ -0,0 +1,511 @@
+import numpy as np
+
+from data_vu.utilities import *
+from data_vu import cache as run_cache
+from data_vu.files import load_config_file
+from data_vu.db import session
+from data_vu.db.material import Material
+from data_vu.db.mutation_strength import MutationStrength
+
+class RunData(object):
+    """Column-oriented, in-memory copy of one run's `materials` rows.
+
+    All rows for a run are read with a single streamed query; every query in
+    `data_vu.queries` can then be answered from these arrays with boolean
+    masks instead of another round trip to the database.
+
+    Missing values are stored as NaN (property columns) or -1 (`parent_id`,
+    `generation` and bin columns).
+
+    """
+
+    columns = [
+        'id',
+        'parent_id',
+        'generation',
+        'ml_absolute_volumetric_loading',
+        'sa_volumetric_surface_area',
+        'vf_helium_void_fraction',
+        'methane_loading_bin',
+        'surface_area_bin',
+        'void_fraction_bin'
+    ]
+    float_columns = [
+        'ml_absolute_volumetric_loading',
+        'sa_volumetric_surface_area',
+        'vf_helium_void_fraction'
+    ]
+
+    def __init__(self, run_id, arrays, strength_rows=None):
+        self.run_id = run_id
+        self.arrays = arrays
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.strength_rows = strength_rows
+        self.strength_history = None
+        self.bin_count_tensor = None
+        self.buffers = {}
+        self.id_order = None
+
+    @classmethod
+    def load(cls, run_id, chunk_size=10000, cache='on'):
+        """Reads every material in a run, from the local cache if it is up to
+        date, otherwise with one streamed query (refreshing the cache).
+
+        Args:
+            run_id (str): run identification string.
+            chunk_size (int): rows fetched per round trip.
+            cache (str): `on`(default), use the cache if its fingerprint
+                matches the database; `trust`, use the cache without checking
+                the database at all; `off`, always query.
+
+        Returns:
+            run_data (RunData): column arrays for the run.
+
+        """
+        if cache == 'off':
+            return cls.query(run_id, chunk_size)
+
+        fingerprint = None
+        if cache != 'trust':
+            fingerprint = run_cache.query_fingerprint(run_id)
+        arrays, strength_rows = run_cache.read_run(run_id, fingerprint)
+        if arrays != None:
+            return cls(run_id, arrays, strength_rows)
+
+        if fingerprint == None:
+            fingerprint = run_cache.query_fingerprint(run_id)
+        run_data = cls.query(run_id, chunk_size, count=fingerprint['materials'])
+        run_data.strength_rows = MutationStrengthHistory.query_rows(
+            run_id, chunk_size, count=fingerprint['mutation_strengths']
+        )
+        run_cache.write_run(run_id, run_data.arrays, run_data.strength_rows, fingerprint)
+        return run_data
+
+    @classmethod
+    def query(cls, run_id, chunk_size=10000, after_id=None, count=None):
+        """Reads every material in a run with one streamed query.
+
+        Args:
+            run_id (str): run identification string.
+            chunk_size (int): rows fetched per round trip.
+            after_id (int): optional, only read materials with a greater id.
+            count (int): optional, expected number of rows, to preallocate.
+
+        Returns:
+            run_data (RunData): column arrays for the run.
+
+        """
+        attrs = [getattr(Material, column) for column in cls.columns]
+        filters = [Material.run_id == run_id]
+        if after_id != None:
+            filters.append(Material.id > after_id)
+        query = session \
+            .query(*attrs) \
+            .filter(*filters) \
+            .order_by(Material.id)
+        table = stream_array(query, len(cls.columns), chunk_size, count)
+        return cls(run_id, cls._split_columns(table))
+
+    @classmethod
+    def _split_columns(cls, table):
+        arrays = {}
+        for i, column in enumerate(cls.columns):
+            values = table[:, i]
+            if column not in cls.float_columns:
+                values = np.where(np.isnan(values), -1, values).astype(np.int64)
+            arrays[column] = values
+        return arrays
+
+    def __len__(self):
+        return len(self.id)
+
+    def update(self, chunk_size=10000):
+        """Appends materials (and mutation strengths) added to the run since
+        the last load or update.
+
+        Only rows past the last seen `materials.id` (and mutation strengths
+        from the last seen generation on) are queried, and arrays grow with
+        spare capacity, so the cost of an update depends on the number of new
+        rows rather than the size of the run. A loaded count tensor is
+        updated in place.
+
+        Returns:
+            generations (<class 'list'>): generations with new rows.
+
+        """
+        last_id = int(self.id[-1]) if len(self) > 0 else None
+        new = RunData.query(self.run_id, chunk_size, after_id=last_id)
+        generations = set(int(gen) for gen in np.unique(new.generation) if gen >= 0)
+
+        if len(new) > 0:
+            self.append(new.arrays)
+
+        if self.strength_rows is not None:
+            first_generation = 0
+            if len(self.strength_rows) > 0:
+                first_generation = int(self.strength_rows[-1, 0])
+            rows = MutationStrengthHistory.query_rows(
+                self.run_id, chunk_size, first_generation=first_generation
+            )
+            kept = self.strength_rows[self.strength_rows[:, 0] < first_generation]
+            if len(rows) != len(self.strength_rows) - len(kept) or \
+                    not np.array_equal(rows, self.strength_rows[len(kept):]):
+                generations |= set(int(gen) for gen in np.unique(rows[:, 0]))
+                self.strength_rows = np.concatenate((kept, rows))
+                if self.strength_history is not None:
+                    self.strength_history.extend(rows)
+
+        return sorted(generations)
+
+    def append(self, arrays):
+        """Appends rows (column-name -> array) to the run, growing each column
+        into a buffer with spare capacity so repeated appends are amortized.
+
+        """
+        length = len(self)
+        added = len(arrays['id'])
+        for column in self.columns:
+            buffer = self.buffers.get(column)
+            if buffer is None or len(buffer) < length + added:
+                buffer = np.empty(max(2 * (length + added), 1024), dtype=self.arrays[column].dtype)
+                buffer[:length] = self.arrays[column]
+                self.buffers[column] = buffer
+            buffer[length:length + added] = arrays[column]
+            self.arrays[column] = buffer[:length + added]
+            setattr(self, column, self.arrays[column])
+
+        self.id_order = None
+        if self.bin_count_tensor is not None:
+            self._add_to_bin_count_tensor(arrays)
+
+    def _add_to_bin_count_tensor(self, arrays):
+        tensor = self.bin_count_tensor
+        number_of_bins = tensor.shape[1]
+        bins = np.column_stack((
+            arrays['methane_loading_bin'],
+            arrays['surface_area_bin'],
+            arrays['void_fraction_bin']
+        ))
+        generation = arrays['generation']
+        valid = (bins >= 0).all(axis=1) & (bins < number_of_bins).all(axis=1)
+        valid &= generation >= 0
+        if not valid.any():
+            return
+
+        last_generation = int(generation[valid].max())
+        if last_generation >= len(tensor):
+            extension = np.repeat(tensor[-1:], last_generation + 1 - len(tensor), axis=0)
+            tensor = self.bin_count_tensor = np.concatenate((tensor, extension))
+
+        first_generation = int(generation[valid].min())
+        shape = (len(tensor) - first_generation,) + tensor.shape[1:]
+        flat_index = np.ravel_multi_index(
+            (generation[valid] - first_generation, bins[valid, 0], bins[valid, 1], bins[valid, 2]),
+            shape
+        )
+        increments = np.bincount(flat_index, minlength=int(np.prod(shape)))
+        tensor[first_generation:] += increments.reshape(shape).cumsum(axis=0)
+
+    def column(self, x):
+        """Returns the array for an axis-code (`ml`, `sa_bin`, etc.)."""
+        return self.arrays[get_attr(x).key]
+
+    def z_column(self, x, y):
+        """Returns the bin array for the axis perpendicular to `x` and `y`."""
+        return self.arrays[get_z_attr(x, y).key]
+
+    def mask(self, x, y, z_bin, gen, cumulative=False):
+        """Boolean mask selecting one generation (or all up to `gen`) and,
+        optionally, one z-axis slice.
+
+        """
+        if cumulative:
+            mask = (self.generation >= 0) & (self.generation <= gen)
+        else:
+            mask = self.generation == gen
+        if z_bin != None:
+            mask &= self.z_column(x, y) == z_bin
+        return mask
+
+    def get_strength_history(self, number_of_bins, initial_strength=np.nan):
+        """Loads (once) the run's mutation strengths for every generation."""
+        if self.strength_history is None:
+            if self.strength_rows is None:
+                self.strength_rows = MutationStrengthHistory.query_rows(self.run_id)
+            self.strength_history = MutationStrengthHistory.from_rows(
+                self.run_id, self.strength_rows, number_of_bins, initial_strength
+            )
+        return self.strength_history
+
+    def count_generations(self):
+        if len(self) == 0:
+            return None
+        return int(self.generation.max())
+
+    def points(self, x, y, z_bin, gen):
+        mask = self.mask(x, y, z_bin, gen)
+        return np.column_stack((self.column(x)[mask], self.column(y)[mask]))
+
+    def previous_points(self, x, y, z_bin, gen):
+        mask = self.mask(x, y, z_bin, gen - 1, cumulative=True)
+        return np.column_stack((self.column(x)[mask], self.column(y)[mask]))
+
+    def get_bin_count_tensor(self, number_of_bins=None):
+        """Cumulative bin-counts, indexed [generation, ml_bin, sa_bin, vf_bin].
+
+        Entry [g, i, j, k] counts materials in bin (i, j, k) from generations
+        0 through g. Built once, with one pass over the run; if
+        `number_of_bins` isn't passed it is read from the run's config.
+
+        """
+        if self.bin_count_tensor is not None and number_of_bins != None and \
+                self.bin_count_tensor.shape[1] != number_of_bins:
+            self.bin_count_tensor = None
+        if self.bin_count_tensor is None:
+            if number_of_bins == None:
+                number_of_bins = load_config_file(self.run_id)['number_of_convergence_bins']
+            bins = np.column_stack((
+                self.methane_loading_bin,
+                self.surface_area_bin,
+                self.void_fraction_bin
+            ))
+            valid = (bins >= 0).all(axis=1) & (bins < number_of_bins).all(axis=1)
+            valid &= self.generation >= 0
+            generations = self.count_generations()
+            generations = generations + 1 if generations != None and generations >= 0 else 1
+            shape = (generations,) + (number_of_bins,) * 3
+            flat_index = np.ravel_multi_index(
+                (self.generation[valid], bins[valid, 0], bins[valid, 1], bins[valid, 2]),
+                shape
+            )
+            increments = np.bincount(flat_index, minlength=int(np.prod(shape)))
+            self.bin_count_tensor = increments.reshape(shape).cumsum(axis=0)
+        return self.bin_count_tensor
+
+    def counts_at(self, gen):
+        """Returns the [ml_bin, sa_bin, vf_bin] bin-counts up to generation `gen`."""
+        tensor = self.get_bin_count_tensor()
+        if gen < 0:
+            return np.zeros_like(tensor[0])
+        return tensor[min(gen, len(tensor) - 1)]
+
+    def bin_count_plane(self, x, y, z_bin, gen):
+        """Returns the dense [x_bin, y_bin] bin-counts up to generation `gen`,
+        for one z-slice or summed along z.
+
+        """
+        counts = orient_bins(self.counts_at(gen), x, y)
+        if z_bin == None:
+            return counts.sum(axis=2)
+        return counts[:, :, z_bin]
+
+    def bin_counts(self, x, y, z_bin, gen):
+        plane = self.bin_count_plane(x, y, z_bin, gen)
+        xs, ys = np.nonzero(plane)
+        return np.column_stack((xs, ys, plane[xs, ys]))
+
+    def all_bin_counts(self, gen=None):
+        """Counts materials in every occupied 3D bin (up to `gen`, if passed)."""
+        if gen == None:
+            gen = len(self.get_bin_count_tensor()) - 1
+        counts = self.counts_at(gen)
+        return counts[counts > 0]
+
+    def max_count(self):
+        return int(self.get_bin_count_tensor()[-1].max())
+
+    def rows_for_ids(self, ids):
+        """Returns row-indices for material ids; -1 where an id is unknown."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        if self.id_order is None:
+            # rows are read (and appended) in id order, so this is normally
+            # the identity (False); checked once, rather than sorting per call
+            if (np.diff(self.id) > 0).all():
+                self.id_order = False
+            else:
+                self.id_order = np.argsort(self.id)
+        if self.id_order is False:
+            sorted_ids = self.id
+        else:
+            sorted_ids = self.id[self.id_order]
+        positions = np.clip(np.searchsorted(sorted_ids, ids), 0, len(sorted_ids) - 1)
+        found = sorted_ids[positions] == ids
+        if self.id_order is not False:
+            positions = self.id_order[positions]
+        return np.where(found, positions, -1)
+
+    def material(self, x, y, id):
+        rows = self.rows_for_ids([id])
+        rows = rows[rows >= 0]
+        return np.column_stack((self.column(x)[rows], self.column(y)[rows]))
+
+    def parents(self, x, y, z_bin, gen):
+        mask = self.mask(x, y, z_bin, gen)
+        parent_ids = self.parent_id[mask]
+        rows = self.rows_for_ids(parent_ids[parent_ids >= 0])
+        rows = rows[rows >= 0]
+        return np.column_stack((self.column(x)[rows], self.column(y)[rows]))
+
+    def child_bins(self, x, y, z_bin, gen):
+        mask = self.mask(x, y, z_bin, gen)
+        bins = np.column_stack((self.column(x)[mask], self.column(y)[mask]))
+        return np.unique(bins, axis=0)
+
+    def child_transitions(self):
+        """Children grouped by generation, parent bin and bin displacement, as
+        [generation, parent ml_bin, sa_bin, vf_bin, child - parent ml_bin,
+        sa_bin, vf_bin, count] rows. Children without a (known) parent or
+        with a missing bin are skipped.
+
+        """
+        parent_rows = self.rows_for_ids(self.parent_id)
+        has_parent = (self.parent_id >= 0) & (parent_rows >= 0) & (self.generation >= 0)
+        bins = np.column_stack((
+            self.methane_loading_bin,
+            self.surface_area_bin,
+            self.void_fraction_bin
+        ))
+        child_bins = bins[has_parent]
+        parent_bins = bins[parent_rows[has_parent]]
+        valid = (child_bins >= 0).all(axis=1) & (parent_bins >= 0).all(axis=1)
+        table = np.column_stack((
+            self.generation[has_parent],
+            parent_bins,
+            child_bins - parent_bins
+        ))[valid]
+        table, counts = np.unique(table.reshape(-1, 7), axis=0, return_counts=True)
+        return np.column_stack((table, counts)).astype(np.int64)
+
+class MutationStrengthHistory(object):
+    """Mutation strengths for every generation of a run.
+
+    `mutation_strengths` is walked once, ordered by generation, carrying a
+    single [ml_bin, sa_bin, vf_bin] strength array forward and storing a
+    snapshot after each generation. Building the history costs
+    O(rows + generations * bins^3); `strength_at` is then a lookup.
+
+    """
+
+    def __init__(self, run_id, snapshots, rows, initial_strength):
+        self.run_id = run_id
+        self.snapshots = snapshots
+        self.buffer = snapshots
+        self.rows = rows
+        self.initial_strength = initial_strength
+
+    @classmethod
+    def load(cls, run_id, number_of_bins, initial_strength=np.nan, chunk_size=10000):
+        """Reads every mutation strength in a run with one ordered query.
+
+        Args:
+            run_id (str): run identification string.
+            number_of_bins (int): bins along each axis.
+            initial_strength (float): strength of bins without a row.
+            chunk_size (int): rows fetched per round trip.
+
+        Returns:
+            history (MutationStrengthHistory)
+
+        """
+        rows = cls.query_rows(run_id, chunk_size)
+        return cls.from_rows(run_id, rows, number_of_bins, initial_strength)
+
+    @classmethod
+    def query_rows(cls, run_id, chunk_size=10000, first_generation=None, count=None):
+        """Queries [generation, ml_bin, sa_bin, vf_bin, strength] rows for a run,
+        ordered by generation (optionally only from `first_generation` on).
+        `count`, if known, preallocates the array.
+
+        """
+        filters = [MutationStrength.run_id == run_id]
+        if first_generation != None:
+            filters.append(MutationStrength.generation >= first_generation)
+        query = session \
+            .query(
+                MutationStrength.generation,
+                MutationStrength.methane_loading_bin,
+                MutationStrength.surface_area_bin,
+                MutationStrength.void_fraction_bin,
+                MutationStrength.strength
+            ) \
+            .filter(*filters) \
+            .order_by(
+                MutationStrength.generation,
+                MutationStrength.methane_loading_bin,
+                MutationStrength.surface_area_bin,
+                MutationStrength.void_fraction_bin
+            )
+        return stream_array(query, 5, chunk_size, count)
+
+    @classmethod
+    def from_rows(cls, run_id, rows, number_of_bins, initial_strength=np.nan):
+        """Builds the history from [generation, ml_bin, sa_bin, vf_bin, strength]
+        rows ordered by generation.
+
+        """
+        coords = rows[:, 1:4].astype(int)
+        in_range = ((coords >= 0) & (coords < number_of_bins)).all(axis=1)
+        rows = rows[in_range & (rows[:, 0] >= 0)]
+
+        generations = rows[:, 0].astype(int)
+        last_generation = generations[-1] if len(rows) > 0 else 0
+        bounds = np.searchsorted(generations, np.arange(last_generation + 2))
+
+        snapshots = np.empty((last_generation + 1,) + (number_of_bins,) * 3)
+        current = np.full((number_of_bins,) * 3, initial_strength, dtype=float)
+        for gen in range(last_generation + 1):
+            changes = rows[bounds[gen]:bounds[gen + 1]]
+            coords = changes[:, 1:4].astype(int)
+            current[coords[:, 0], coords[:, 1], coords[:, 2]] = changes[:, 4]
+            snapshots[gen] = current
+        return cls(run_id, snapshots, rows, initial_strength)
+
+    def extend(self, rows):
+        """Replaces the rows from their first generation on with `rows`
+        ([generation, ml_bin, sa_bin, vf_bin, strength], ordered by
+        generation) and rebuilds only the snapshots from that generation on,
+        starting from the one before it. Snapshots grow into a buffer with
+        spare capacity, so repeated extends are amortized.
+
+        """
+        number_of_bins = self.snapshots.shape[1]
+        coords = rows[:, 1:4].astype(int)
+        in_range = ((coords >= 0) & (coords < number_of_bins)).all(axis=1)
+        rows = rows[in_range & (rows[:, 0] >= 0)]
+        if len(rows) == 0:
+            return
+
+        generations = rows[:, 0].astype(int)
+        first_generation = min(generations[0], len(self.snapshots))
+        last_generation = max(generations[-1], len(self.snapshots) - 1)
+        self.rows = np.concatenate((self.rows[self.rows[:, 0] < generations[0]], rows))
+        current = self.strength_at(first_generation - 1).copy()
+
+        if len(self.buffer) < last_generation + 1:
+            buffer = np.empty((2 * (last_generation + 1),) + self.snapshots.shape[1:])
+            buffer[:len(self.snapshots)] = self.snapshots
+            self.buffer = buffer
+        self.snapshots = self.buffer[:last_generation + 1]
+
+        bounds = np.searchsorted(generations, np.arange(first_generation, last_generation + 2))
+        for gen in range(first_generation, last_generation + 1):
+            changes = rows[bounds[gen - first_generation]:bounds[gen - first_generation + 1]]
+            coords = changes[:, 1:4].astype(int)
+            current[coords[:, 0], coords[:, 1], coords[:, 2]] = changes[:, 4]
+            self.snapshots[gen] = current
+
+    def strength_at(self, gen):
+        """Returns the [ml_bin, sa_bin, vf_bin] strength array in effect at `gen`."""
+        if gen < 0:
+            return np.full(self.snapshots.shape[1:], self.initial_strength)
+        return self.snapshots[min(gen, len(self.snapshots) - 1)]
+
+    def changes(self, gen):
+        """Returns the [generation, ml_bin, sa_bin, vf_bin, strength] rows written
+        in `gen`, i.e. the delta from the previous generation's strengths.
+
+        """
+        return self.rows[self.rows[:, 0] == gen]
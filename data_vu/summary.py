@@ -0,0 +1,232 @@
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from data_vu.utilities import *
+from data_vu.db import session, create_tables
+from data_vu.db.material import Material
+from data_vu.db.material_summary import MaterialSummary, SummaryState
+
+properties = [
+    ('ml', Material.ml_absolute_volumetric_loading),
+    ('sa', Material.sa_volumetric_surface_area),
+    ('vf', Material.vf_helium_void_fraction)
+]
+
+_tables_created = False
+
+# generations below the newest summarized one that every refresh recomputes,
+# to pick up rows committed late (an id allocated before the last refresh) or
+# binned after they were inserted
+RESCAN_GENERATIONS = 2
+
+def refresh_summary(run_id, rescan_generations=RESCAN_GENERATIONS):
+    """Brings `material_summaries` up to date with a run's materials.
+
+    The summary rows of every generation from the earliest one among new
+    materials (`id` above the run's stored high-water mark), and of the last
+    `rescan_generations` summarized generations, are recomputed from
+    `materials` and replaced. So the cost of a refresh follows the size of the
+    generations being written, not of the run, and rows another HTSOHM worker
+    commits late, or whose bins are filled in after they are inserted, are
+    picked up by a later refresh as long as they are in those generations.
+
+    Args:
+        run_id (str): run identification string.
+        rescan_generations (int): see above; None recomputes the whole run.
+
+    Returns:
+        new_materials (int): change in the number of materials summarized.
+
+    The summary tables belong to data_vu (not HTSOHM), so they are created
+    here, on the first refresh, if they don't exist. Concurrent refreshes of
+    one run are serialized on the run's `SummaryState` row.
+
+    """
+    global _tables_created
+    if not _tables_created:
+        create_tables([MaterialSummary.__table__, SummaryState.__table__])
+        _tables_created = True
+
+    try:
+        return _refresh_summary(run_id, rescan_generations)
+    except:
+        session.rollback()
+        raise
+
+def _lock_state(run_id):
+    """Returns the run's `SummaryState` (created if missing), locked until
+    the session commits, so another refresh can't read the same high-water
+    mark meanwhile. The no-op UPDATE takes the lock where SELECT ... FOR
+    UPDATE doesn't exist (SQLite locks the database on the first write).
+    """
+    exists = session.query(SummaryState.run_id).filter(SummaryState.run_id == run_id).first()
+    if exists == None:
+        try:
+            session.add(SummaryState(run_id=run_id, max_material_id=0))
+            session.commit()
+        except IntegrityError:
+            # another refresh created it first
+            session.rollback()
+    session \
+        .query(SummaryState) \
+        .filter(SummaryState.run_id == run_id) \
+        .update(
+            {SummaryState.max_material_id : SummaryState.max_material_id},
+            synchronize_session=False
+        )
+    return session \
+        .query(SummaryState) \
+        .filter(SummaryState.run_id == run_id) \
+        .with_for_update() \
+        .populate_existing() \
+        .one()
+
+def _refresh_summary(run_id, rescan_generations):
+    state = _lock_state(run_id)
+
+    max_id, first_new_generation = session \
+        .query(func.max(Material.id), func.min(Material.generation)) \
+        .filter(
+            Material.run_id == run_id,
+            Material.id > state.max_material_id
+        ) \
+        .one()
+    first_generation = first_new_generation
+    if rescan_generations == None:
+        first_generation = 0
+    else:
+        last_summarized = session \
+            .query(func.max(MaterialSummary.generation)) \
+            .filter(MaterialSummary.run_id == run_id) \
+            .scalar()
+        if last_summarized != None:
+            rescan_from = last_summarized - rescan_generations
+            if first_generation == None or rescan_from < first_generation:
+                first_generation = rescan_from
+    if first_generation == None:
+        session.commit()
+        return 0
+
+    bins = [
+        Material.generation,
+        Material.methane_loading_bin,
+        Material.surface_area_bin,
+        Material.void_fraction_bin
+    ]
+    aggregates = [func.count(Material.id)]
+    for name, column in properties:
+        aggregates += [func.min(column), func.max(column), func.avg(column), func.count(column)]
+    rows = session \
+        .query(*(bins + aggregates)) \
+        .filter(
+            Material.run_id == run_id,
+            Material.generation >= first_generation,
+            *[column != None for column in bins]
+        ) \
+        .group_by(*bins) \
+        .all()
+
+    replaced = session \
+        .query(MaterialSummary) \
+        .filter(
+            MaterialSummary.run_id == run_id,
+            MaterialSummary.generation >= first_generation
+        )
+    old_count = replaced.with_entities(func.sum(MaterialSummary.count)).scalar() or 0
+    replaced.delete(synchronize_session=False)
+
+    summaries = []
+    for row in rows:
+        summary = {
+            'run_id' : run_id,
+            'generation' : row[0],
+            'methane_loading_bin' : row[1],
+            'surface_area_bin' : row[2],
+            'void_fraction_bin' : row[3],
+            'count' : row[4]
+        }
+        # means are over materials with the property set (`<name>_count`),
+        # not every material in the bin
+        for i, (name, column) in enumerate(properties):
+            values = row[5 + 4 * i : 9 + 4 * i]
+            for suffix, value in zip(['_min', '_max', '_mean', '_count'], values):
+                summary[name + suffix] = value
+        summaries.append(summary)
+    if len(summaries) > 0:
+        session.execute(MaterialSummary.__table__.insert(), summaries)
+
+    if max_id != None:
+        state.max_material_id = max_id
+    session.commit()
+    return sum(row[4] for row in rows) - old_count
+
+class RunSummary(object):
+    """Answers bin-count queries for one run from `material_summaries`
+    instead of aggregating raw `materials` rows.
+
+    Pass it as `summary` to the functions in `data_vu.queries`.
+
+    """
+
+    def __init__(self, run_id, refresh=True):
+        self.run_id = run_id
+        if refresh:
+            refresh_summary(run_id)
+
+    def attr(self, x):
+        return getattr(MaterialSummary, get_attr(x).key)
+
+    def z_attr(self, x, y):
+        return getattr(MaterialSummary, get_z_attr(x, y).key)
+
+    def bin_counts(self, x, y, z_bin, gen):
+        x_attr = self.attr(x)
+        y_attr = self.attr(y)
+        filters = [
+            MaterialSummary.run_id == self.run_id,
+            MaterialSummary.generation <= gen
+        ]
+        if z_bin != None:
+            filters.append(self.z_attr(x, y) == z_bin)
+        return session \
+            .query(x_attr, y_attr, func.sum(MaterialSummary.count)) \
+            .filter(*filters) \
+            .group_by(x_attr, y_attr) \
+            .all()
+
+    def all_bin_counts(self, gen=None):
+        filters = [MaterialSummary.run_id == self.run_id]
+        if gen != None:
+            filters.append(MaterialSummary.generation <= gen)
+        counts = session \
+            .query(func.sum(MaterialSummary.count)) \
+            .filter(*filters) \
+            .group_by(
+                MaterialSummary.methane_loading_bin,
+                MaterialSummary.surface_area_bin,
+                MaterialSummary.void_fraction_bin
+            ) \
+            .all()
+        return np.array([count for (count,) in counts], dtype=np.int64)
+
+    def max_count(self):
+        counts = self.all_bin_counts()
+        if len(counts) == 0:
+            return 0
+        return int(counts.max())
+
+    def child_bins(self, x, y, z_bin, gen):
+        x_attr = self.attr(x)
+        y_attr = self.attr(y)
+        filters = [
+            MaterialSummary.run_id == self.run_id,
+            MaterialSummary.generation == gen
+        ]
+        if z_bin != None:
+            filters.append(self.z_attr(x, y) == z_bin)
+        return session \
+            .query(x_attr, y_attr) \
+            .filter(*filters) \
+            .group_by(x_attr, y_attr) \
+            .all()
@@ -0,0 +1,185 @@
+import uuid
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.sql import text
+
+from data_vu.db import session
+from data_vu.db.material import Material
+from data_vu.db.mutation_strength import MutationStrength
+from data_vu.db.material_summary import MaterialSummary, SummaryState
+
+DEFAULT_CONFIG = {
+    'number_of_convergence_bins' : 10,
+    'initial_mutation_strength' : 0.2,
+    'methane_loading_limits' : [0., 350.],
+    'surface_area_limits' : [0., 4500.],
+    'void_fraction_limits' : [0., 1.]
+}
+
+PROPERTIES = [
+    ('ml_absolute_volumetric_loading', 'methane_loading_limits', 'methane_loading_bin'),
+    ('sa_volumetric_surface_area', 'surface_area_limits', 'surface_area_bin'),
+    ('vf_helium_void_fraction', 'void_fraction_limits', 'void_fraction_bin')
+]
+
+def generate_run(
+        run_id,
+        generations = 10,
+        children_per_generation = 100,
+        number_of_bins = 10,
+        parents_per_generation = None,
+        retest_fraction = 0.,
+        seed = 0,
+        chunk_size = 10000
+    ):
+    """Populates the database with a synthetic HTSOHM run, for benchmarks.
+
+    Generation 0 is sampled uniformly over the property limits. In every
+    later generation, parents are drawn from all earlier materials, weighted
+    towards sparsely populated bins (as HTSOHM does), and each child is its
+    parent's properties plus gaussian noise scaled by the parent bin's
+    mutation strength. The strength of every bin that had parents is then
+    rescaled and written to `mutation_strengths` for that generation.
+
+    Any existing rows for `run_id` are deleted first.
+
+    Args:
+        run_id (str): run identification string.
+        generations (int): number of generations, including generation 0.
+        children_per_generation (int): materials per generation.
+        number_of_bins (int): bins along each of the three axes.
+        parents_per_generation (int): distinct parents per generation;
+            defaults to a tenth of `children_per_generation`.
+        retest_fraction (float): fraction of materials given retest columns
+            (`retest_num` of 1 to 3, sums within a few percent of the value).
+        seed (int): random seed; the same arguments give the same run.
+        chunk_size (int): rows per INSERT.
+
+    Returns:
+        config (dict): a run config for the synthetic run, as
+            `data_vu.files.load_config_file` would return.
+
+    """
+    if parents_per_generation == None:
+        parents_per_generation = max(children_per_generation // 10, 1)
+    config = dict(DEFAULT_CONFIG)
+    config['number_of_convergence_bins'] = number_of_bins
+    config['number_of_generations'] = generations
+    config['children_per_generation'] = children_per_generation
+
+    delete_run(run_id)
+    random = np.random.RandomState(seed)
+    lower = np.array([config[limits][0] for _, limits, _ in PROPERTIES])
+    upper = np.array([config[limits][1] for _, limits, _ in PROPERTIES])
+    first_id = (session.query(func.max(Material.id)).scalar() or 0) + 1
+
+    values = np.empty((0, 3))
+    bins = np.empty((0, 3), dtype=int)
+    bin_counts = np.zeros((number_of_bins,) * 3, dtype=np.int64)
+    strengths = np.full((number_of_bins,) * 3, config['initial_mutation_strength'])
+    for generation in range(generations):
+        if generation == 0:
+            parent_rows = None
+            new_values = lower + random.rand(children_per_generation, 3) * (upper - lower)
+        else:
+            weights = 1. / bin_counts[bins[:, 0], bins[:, 1], bins[:, 2]]
+            parents = random.choice(
+                len(values),
+                size = min(parents_per_generation, len(values)),
+                replace = False,
+                p = weights / weights.sum()
+            )
+            parent_rows = parents[random.randint(len(parents), size=children_per_generation)]
+            parent_bins = bins[parent_rows]
+            scale = strengths[parent_bins[:, 0], parent_bins[:, 1], parent_bins[:, 2]]
+            new_values = values[parent_rows] + \
+                random.randn(children_per_generation, 3) * scale[:, np.newaxis] * (upper - lower)
+            new_values = np.clip(new_values, lower, upper)
+
+        new_bins = ((new_values - lower) / (upper - lower) * number_of_bins).astype(int)
+        new_bins = np.minimum(new_bins, number_of_bins - 1)
+        _insert_materials(
+            run_id, generation, first_id + len(values),
+            first_id + parent_rows if parent_rows is not None else None,
+            new_values, new_bins, retest_fraction, random, chunk_size
+        )
+        if parent_rows is not None:
+            parent_bins = np.unique(bins[parent_rows], axis=0)
+            _update_strengths(run_id, generation, strengths, parent_bins, random)
+
+        values = np.concatenate((values, new_values))
+        bins = np.concatenate((bins, new_bins))
+        np.add.at(bin_counts, (new_bins[:, 0], new_bins[:, 1], new_bins[:, 2]), 1)
+
+    _advance_id_sequence()
+    session.commit()
+    return config
+
+def _advance_id_sequence():
+    # rows are inserted with explicit ids, which doesn't move a PostgreSQL
+    # serial sequence; without this the next ORM (e.g. HTSOHM) insert would
+    # be given an id that is already taken
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text(
+            "select setval(pg_get_serial_sequence('materials', 'id'), "
+            "(select max(id) from materials))"
+        ))
+
+def _insert_materials(run_id, generation, first_id, parent_ids, values, bins, retest_fraction,
+                      random, chunk_size):
+    rows = []
+    for i in range(len(values)):
+        row = {
+            'id' : first_id + i,
+            'run_id' : run_id,
+            'uuid' : str(uuid.UUID(bytes=random.bytes(16), version=4)),
+            'parent_id' : int(parent_ids[i]) if parent_ids is not None else None,
+            'generation' : generation,
+            'generation_index' : i,
+            'retest_num' : 0,
+            'retest_methane_loading_sum' : 0.,
+            'retest_surface_area_sum' : 0.,
+            'retest_void_fraction_sum' : 0.
+        }
+        for j, (column, _, bin_column) in enumerate(PROPERTIES):
+            row[column] = float(values[i, j])
+            row[bin_column] = int(bins[i, j])
+        if random.rand() < retest_fraction:
+            retest_num = random.randint(1, 4)
+            row['retest_num'] = retest_num
+            for j, column in enumerate([
+                    'retest_methane_loading_sum',
+                    'retest_surface_area_sum',
+                    'retest_void_fraction_sum']):
+                row[column] = float(values[i, j] * retest_num * random.uniform(0.95, 1.05))
+        rows.append(row)
+        if len(rows) == chunk_size:
+            session.execute(Material.__table__.insert(), rows)
+            rows = []
+    if len(rows) > 0:
+        session.execute(Material.__table__.insert(), rows)
+
+def _update_strengths(run_id, generation, strengths, parent_bins, random):
+    rows = []
+    for ml_bin, sa_bin, vf_bin in parent_bins:
+        strength = strengths[ml_bin, sa_bin, vf_bin] * random.choice([0.5, 1., 1.5])
+        strength = min(max(strength, 0.005), 0.5)
+        strengths[ml_bin, sa_bin, vf_bin] = strength
+        rows.append({
+            'run_id' : run_id,
+            'generation' : generation,
+            'methane_loading_bin' : int(ml_bin),
+            'surface_area_bin' : int(sa_bin),
+            'void_fraction_bin' : int(vf_bin),
+            'strength' : float(strength)
+        })
+    session.execute(MutationStrength.__table__.insert(), rows)
+
+def delete_run(run_id):
+    """Deletes every row belonging to a run, including its summary."""
+    for model in [Material, MutationStrength, MaterialSummary, SummaryState]:
+        session.query(model) \
+            .filter(model.run_id == run_id) \
+            .delete(synchronize_session=False)
+    session.commit()
@@ -1,54 +1,95 @@
+import itertools
+
+import numpy as np
+
 from data_vu.db.material import Material
 from data_vu.db.mutation_strength import MutationStrength
 from data_vu.files import load_config_file
 
+LIMITS = {
+    'ml' : 'methane_loading_limits',
+    'sa' : 'surface_area_limits',
+    'vf' : 'void_fraction_limits'
+}
+
+ATTRS = {
+    'ml' : Material.ml_absolute_volumetric_loading,
+    'sa' : Material.sa_volumetric_surface_area,
+    'vf' : Material.vf_helium_void_fraction,
+    'ml_mutation_strength' : MutationStrength.methane_loading_bin,
+    'sa_mutation_strength' : MutationStrength.surface_area_bin,
+    'vf_mutation_strength' : MutationStrength.void_fraction_bin,
+    'ml_bin' : Material.methane_loading_bin,
+    'sa_bin' : Material.surface_area_bin,
+    'vf_bin' : Material.void_fraction_bin
+}
+
+Z_ATTRS = {
+    frozenset(['ml', 'sa']) : Material.void_fraction_bin,
+    frozenset(['sa', 'vf']) : Material.methane_loading_bin,
+    frozenset(['ml', 'vf']) : Material.surface_area_bin
+}
+
 def get_limits(x, config):
-    if 'ml' in x:
-        limits = config['methane_loading_limits']
-    elif 'sa' in x:
-        limits = config['surface_area_limits']
-    elif 'vf' in x:
-        limits = config['void_fraction_limits']
-    return limits
+    return config[LIMITS[x[:2]]]
 
 def get_attr(x):
-    if x == 'ml':
-        attr = getattr(Material, 'ml_absolute_volumetric_loading')
-    elif x == 'sa':
-        attr = getattr(Material, 'sa_volumetric_surface_area')
-    elif x == 'vf':
-        attr = getattr(Material, 'vf_helium_void_fraction')
-    elif x == 'ml_mutation_strength':
-        attr = getattr(MutationStrength, 'methane_loading_bin')
-    elif x == 'sa_mutation_strength':
-        attr = getattr(MutationStrength, 'surface_area_bin')
-    elif x == 'vf_mutation_strength':
-        attr = getattr(MutationStrength, 'void_fraction_bin')
-    elif x == 'ml_bin':
-        attr = getattr(Material, 'methane_loading_bin')
-    elif x == 'sa_bin':
-        attr = getattr(Material, 'surface_area_bin')
-    elif x == 'vf_bin':
-        attr = getattr(Material, 'void_fraction_bin')
-    else:
-        print('--flag not understood--')
-
-    return attr
+    return ATTRS[x]
 
 def get_width(x, config):
     x_limits = get_limits(x, config)
     return (x_limits[1] - x_limits[0]) / config['number_of_convergence_bins']
 
 def get_z_attr(x, y):
-    if x[:2] in ['ml', 'sa'] and y[:2] in ['ml', 'sa']:
-        z_attr = getattr(Material, 'void_fraction_bin')
-    elif x[:2] in ['sa', 'vf'] and y[:2] in ['sa', 'vf']:
-        z_attr = getattr(Material, 'methane_loading_bin')
-    elif x[:2] in ['ml', 'vf'] and y[:2] in ['ml', 'vf']:
-        z_attr = getattr(Material, 'surface_area_bin')
-    else:
-        print('--flag not understood')
-    return z_attr
+    return Z_ATTRS[frozenset([x[:2], y[:2]])]
+
+def get_axis(x):
+    """Returns the index (0, 1, 2) of an axis-code in [ml, sa, vf] bin order."""
+    return ['ml', 'sa', 'vf'].index(x[:2])
+
+def orient_bins(array, x, y):
+    """Reorders the last three axes of an array indexed [..., ml_bin, sa_bin, vf_bin]
+    to [..., x_bin, y_bin, z_bin].
+    """
+    x_axis = get_axis(x)
+    y_axis = get_axis(y)
+    z_axis = 3 - x_axis - y_axis
+    leading = tuple(range(array.ndim - 3))
+    return array.transpose(leading + tuple(len(leading) + i for i in [x_axis, y_axis, z_axis]))
+
+def stream_array(query, width, chunk_size=10000, count=None):
+    """Runs a query with a streaming (server-side, on PostgreSQL) cursor and
+    copies its rows into one float array, `chunk_size` rows at a time.
+
+    At most one chunk of rows exists as Python objects at once. The array is
+    preallocated from `count` when the caller already knows it, and otherwise
+    (or if more rows arrive than were counted, e.g. a run still being
+    written) grows by doubling; NULLs become NaN.
+
+    Args:
+        query (sqlalchemy.orm.Query): selecting `width` numeric columns.
+        width (int): number of columns.
+        chunk_size (int): rows fetched per round trip.
+        count (int): optional, expected number of rows.
+
+    Returns:
+        values (numpy.ndarray): shape (rows, width).
+
+    """
+    values = np.empty((count if count != None else 0, width))
+    rows = iter(query.yield_per(chunk_size))
+    filled = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if len(chunk) == 0:
+            break
+        if filled + len(chunk) > len(values):
+            values = np.resize(values, (max(2 * len(values), filled + len(chunk)), width))
+        values[filled:filled + len(chunk)] = np.array(chunk, dtype=float).reshape(-1, width)
+        filled += len(chunk)
+    if filled < len(values):
+        values = values[:filled]
+    return values
 
 def make_list(x):
     if type(x) != type([]):